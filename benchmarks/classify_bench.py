@@ -0,0 +1,69 @@
+"""
+Compares the single pass classifier with the per question regexes it replaced
+(hilight, Announcement.subject_type, PostponedHandler and Announcement.links) on the synthetic corpus (benchmarks/corpus.py).
+
+Run it from anywhere:
+    python3 benchmarks/classify_bench.py --size 100000
+"""
+import argparse
+import json
+import pathlib
+import re
+import sys
+import time
+
+BENCHMARKS = pathlib.Path(__file__).resolve().parent
+sys.path[:0] = [str(BENCHMARKS.parent), str(BENCHMARKS)]
+from corpus import MESSAGE_SEPARATOR, make_notifications  # noqa: E402
+from utilities.classifier import classify  # noqa: E402
+
+
+def make_corpus(size: int) -> list[tuple[str, str]]:
+    """
+    (title, message) pairs, the message is what Announcement keeps of fullmessage.
+    """
+    return [(i["subject"], i["fullmessage"].split(MESSAGE_SEPARATOR)[1]) for i in make_notifications(size)]
+
+
+def scattered_regexes(title: str, message: str):
+    """
+    The classification path as it was before the classifier, kept here as the baseline.
+    """
+    important = bool(re.findall(
+        r"\blab\b|\btest\b|\bquiz\b|\bfinal\b|\bgrades\b|\bgrade\b|\bmakeup\b|\bincomplete exam\b|\bproject\b|\bexam\b|\bmidterm\b",
+        title.lower(), flags=re.MULTILINE))
+    non_exam_types, exam_types = (
+        "lab", "project", "session"), ("quiz", "test", "exam", "grades", "midterm")
+    type_dict = dict.fromkeys(exam_types, "exam") | {
+        name: name for name in non_exam_types}
+    types = set(map(lambda x: type_dict.get(x, None), re.findall(
+        "|".join(non_exam_types + exam_types), title.split(":")[1].lower())))
+    postponed = bool(re.findall(
+        "|".join(("postponed", "new date", "delayed")), title.lower()))
+    links = tuple(filter(lambda link: re.search("teams|zoom|meeting", link, flags=re.IGNORECASE),
+                         re.findall(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", message, re.MULTILINE)))
+    return important, types, postponed, links
+
+
+def time_it(function, corpus) -> float:
+    start = time.perf_counter()
+    for title, message in corpus:
+        function(title, message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    corpus = make_corpus(args.size)
+    baseline = min(time_it(scattered_regexes, corpus)
+                   for _ in range(args.runs))
+    single_pass = min(time_it(classify, corpus) for _ in range(args.runs))
+    print(json.dumps({"benchmark": "classifier", "size": args.size, "seconds": {
+          "scattered_regexes": baseline, "classifier": single_pass}, "speedup": baseline / single_pass}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Synthetic moodle notification payloads: titles like "COMP210: Quiz postponed", messages with the dashed separator,
+absolute ("Monday 21 March") and relative ("next week", "tomorrow", "week 7") dates and zoom/teams/moodle links.
+The same seed always gives the same corpus, so benchmark numbers stay comparable between commits.
+
+Write a data directory the bot can run on:
+    python3 benchmarks/corpus.py --size 10000 --out /tmp/corpus
+"""
+from __future__ import annotations
+import argparse
+import json
+import pathlib
+import random
+
+MESSAGE_SEPARATOR = "-" * 69
+# (subject code, course name)
+COURSES = (("COMP210", "Data Structures"), ("COMP208", "Object Oriented Programming"), ("COMP225", "Algorithms"),
+           ("COMP312", "Operating Systems"), ("COMP336", "Databases"), ("MATH281", "Linear Algebra"),
+           ("MATH283", "Discrete Mathematics"), ("PHYS281", "Physics for Engineers"), ("ENGL211", "Technical Writing"),
+           ("ARAB001", "Arabic Language"), ("CMPS241", "Software Engineering"), ("POLS301", "Political Science"))
+KINDS = ("Quiz", "Exam", "Midterm exam", "Final exam", "Lab", "Lab session", "Project", "Project presentation",
+         "Grades", "Makeup exam", "Incomplete exam", "Session", "Lecture", "Material", "Announcement", "Assignment")
+POSTPONEMENTS = ("postponed", "new date", "delayed")
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+MONTHS = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December")
+RELATIVE_DATES = ("tomorrow", "next week", "next day", "after tomorrow", "the following week", "next month")
+LINKS = ("https://zoom.us/j/{id}?pwd=Q{id}x", "https://teams.microsoft.com/l/meetup-join/19%3ameeting_{id}%40thread.v2/0",
+         "https://moodle.bau.edu.lb/mod/resource/view.php?id={id}", "https://moodle.bau.edu.lb/mod/assign/view.php?id={id}")
+FILLER = ("Dear students,", "Please be informed that", "Kindly note that", "As discussed in class,",
+          "Best regards.", "Good luck!", "Attendance is mandatory.", "Bring your student ID.",
+          "The material covers chapters 3 to 5.", "Solutions will be posted on moodle.", "Room B204 is reserved.")
+# first timecreated of the corpus, a fall semester
+START = 1_662_000_000
+
+
+class CorpusGenerator:
+    def __init__(self, seed: int = 0, start: int = START) -> None:
+        self.random = random.Random(seed)
+        self.start = start
+
+    def title(self, code: str) -> str:
+        kind = self.random.choice(KINDS)
+        number = f" {self.random.randint(1, 4)}" if self.random.random() < 0.4 else ""
+        postponed = f" {self.random.choice(POSTPONEMENTS)}" if self.random.random() < 0.12 else ""
+        return f"{code}: {kind}{number}{postponed}"
+
+    def date_phrase(self) -> str:
+        roll = self.random.random()
+        if roll < 0.45:
+            return f"on {self.random.choice(DAYS)} {self.random.randint(1, 28)} {self.random.choice(MONTHS)}"
+        if roll < 0.75:
+            return self.random.choice(RELATIVE_DATES)
+        if roll < 0.85:
+            return f"during week {self.random.randint(1, 14)}"
+        return ""
+
+    def message(self, title: str, notification_id: int) -> str:
+        sentences = self.random.sample(FILLER, k=self.random.randint(1, 4))
+        sentences.insert(1, f"the {title.split(': ')[1].lower()} will be held {self.date_phrase()} at "
+                         f"{self.random.randint(8, 17)}:{self.random.choice(('00', '30'))}.")
+        if self.random.random() < 0.35:
+            sentences.append(
+                self.random.choice(LINKS).format(id=notification_id))
+        return f"{title}\n{MESSAGE_SEPARATOR}\n{' '.join(sentences)}\n{MESSAGE_SEPARATOR}\nThis message was sent from moodle."
+
+    def notification(self, notification_id: int, timecreated: int) -> dict:
+        code, _ = self.random.choice(COURSES)
+        title = self.title(code)
+        return {"id": notification_id, "useridto": 20663, "useridfrom": self.random.randint(100, 900),
+                "subject": title, "shortenedsubject": title, "text": title, "fullmessage": self.message(title, notification_id),
+                "fullmessageformat": 0, "timecreated": timecreated, "read": False, "deleted": False,
+                "component": "mod_forum", "eventtype": "posts"}
+
+    def notifications(self, size: int) -> list[dict]:
+        """
+        Newest first like moodle, roughly one notification every couple of hours.
+        """
+        timestamps = sorted((self.start + self.random.randint(0, 7200) + i * 7200 for i in range(size)), reverse=True)
+        return [self.notification(size - i, timecreated) for i, timecreated in enumerate(timestamps)]
+
+
+def make_notifications(size: int, seed: int = 0) -> list[dict]:
+    return CorpusGenerator(seed).notifications(size)
+
+
+def make_courses() -> list[dict]:
+    return [{"id": i, "fullname": f"{name} - {code}", "shortname": code,
+             "viewurl": f"https://moodle.bau.edu.lb/course/view.php?id={i}"} for i, (code, name) in enumerate(COURSES)]
+
+
+def calendar_text(year: int) -> str:
+    """
+    What semester_utils extracts from the university calendar pdf (whitespace removed), for the previous and the given year.
+    """
+    return "".join(f"2-Feb-{i % 100}Springsemesterbeginsforallfaculties1-Jul-{i % 100}Summersessionbegins"
+                   f"5-Sep-{i % 100}Fallsemesterbeginsforallfaculties" for i in (year - 1, year))
+
+
+def write_data_dir(data_dir: pathlib.Path, size: int, seed: int = 0):
+    """
+    results.json, courses.json and mappings.json in the shapes the bot used to keep them, the store imports them on first use.
+    """
+    data_dir.mkdir(parents=True, exist_ok=True)
+    courses = make_courses()
+    (data_dir / "results.json").write_text(json.dumps(
+        [{"error": False, "data": {"notifications": make_notifications(size, seed), "unreadcount": 0}}]))
+    (data_dir / "courses.json").write_text(json.dumps(
+        [{"error": False, "data": {"courses": courses, "nextoffset": len(courses)}}]))
+    (data_dir / "mappings.json").write_text(json.dumps(
+        {i["shortname"]: i["fullname"].split("-")[0] for i in courses}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=pathlib.Path, required=True,
+                        help="the bot_data_stuff directory to write")
+    args = parser.parse_args()
+    write_data_dir(args.out, args.size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+A local stand-in for icas.bau.edu.lb (CAS) and moodle.bau.edu.lb, so the fetchers can be measured without the real site.
+
+It serves the CAS login page with an execution field, sets the two moodle cookies, serves /my/ with a sesskey,
+answers lib/ajax/service.php with canned notification and course payloads and serves course and assignment pages
+(with ETags, so the conditional crawler gets its 304s). Every response can be delayed and a share of them replaced
+by a 503 to see how the fetchers behave on a slow or flaky site.
+
+Standalone (prints the address and serves until interrupted):
+    python3 benchmarks/fake_moodle.py --latency 0.05 --failure-rate 0.1
+"""
+from __future__ import annotations
+import argparse
+from collections import Counter
+import hashlib
+import http.server
+import json
+import random
+import secrets
+import threading
+import time
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlsplit
+import httpx
+
+MESSAGE_SEPARATOR = "-" * 69
+SUBJECTS = ("COMP210", "COMP208", "MATH281", "PHYS281", "ENGL211", "COMP225")
+CAS_HOST, MOODLE_HOST = "icas.bau.edu.lb", "moodle.bau.edu.lb"
+MOODLE_URL = f"https://{MOODLE_HOST}"
+
+
+def canned_notifications(count: int, start: int = 1_650_000_000) -> list[dict]:
+    """
+    Newest first, like moodle returns them.
+    """
+    notifications = [{"id": i, "timecreated": start + i * 3600, "useridfrom": 1,
+                      "subject": f"{SUBJECTS[i % len(SUBJECTS)]}: Quiz {i}",
+                      "fullmessage": f"Quiz {i}\n{MESSAGE_SEPARATOR}\nThe quiz will be held on Monday March {i % 28 + 1} "
+                      f"at 10:00 https://zoom.us/j/{i}"} for i in range(1, count + 1)]
+    return notifications[::-1]
+
+
+def canned_courses(count: int) -> list[dict]:
+    return [{"id": i, "fullname": f"{SUBJECTS[i % len(SUBJECTS)]} - Course {i}", "shortname": SUBJECTS[i % len(SUBJECTS)],
+             "viewurl": f"{MOODLE_URL}/course/view.php?id={i}"} for i in range(count)]
+
+
+def course_page(course_id: int, assignments: int) -> str:
+    items = "".join(f'<li class="activity modtype_assign"><a href="{MOODLE_URL}/mod/assign/view.php?id={course_id * 1000 + i}">'
+                    f"Assignment {i}</a></li>" for i in range(assignments))
+    return f"<html><body><ul class='section'>{items}</ul></body></html>"
+
+
+def assignment_page(assignment_id: int) -> str:
+    return (f"<html><body><div><div><h2>Assignment {assignment_id}</h2></div></div>"
+            f"<div id='intro'><div><p><a href='{MOODLE_URL}/pluginfile.php/{assignment_id}/brief.pdf'>brief</a></p></div></div>"
+            f"<div class='submissionstatustable'><table><tr><th>Due date</th>"
+            f"<td>Monday, 21 March 2022, 11:59 PM</td></tr></table></div></body></html>")
+
+
+class FakeMoodle(http.server.ThreadingHTTPServer):
+    """
+    Counts requests per path and the bytes going in and out, reset() zeroes the counters between runs.
+    Use it as a context manager, it serves from a daemon thread on a free port.
+    """
+    daemon_threads = True
+
+    def __init__(self, notifications: Optional[list[dict]] = None, courses: Optional[list[dict]] = None,
+                 assignments_per_course: int = 3, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), FakeMoodleHandler)
+        self.notifications = canned_notifications(
+            100) if notifications is None else notifications
+        self.courses = canned_courses(6) if courses is None else courses
+        self.assignments_per_course = assignments_per_course
+        self.latency, self.failure_rate = latency, failure_rate
+        self.random = random.Random(seed)
+        self.sessions: dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def address(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.requests: Counter[str] = Counter()
+            self.bytes = Counter(sent=0, received=0)
+            self.failures = 0
+
+    def expire_sessions(self):
+        self.sessions.clear()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def __enter__(self) -> FakeMoodle:
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeMoodleHandler(http.server.BaseHTTPRequestHandler):
+    server: FakeMoodle
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def cookies(self) -> dict[str, str]:
+        pairs = (i.strip().partition("=")
+                 for i in self.headers.get("Cookie", "").split(";") if "=" in i)
+        return {name: value for name, _, value in pairs}
+
+    def session_key(self) -> Optional[str]:
+        cookies = self.cookies()
+        return self.server.sessions.get(f"{cookies.get('MoodleSession')}/{cookies.get('BNES_MoodleSession')}")
+
+    def reply(self, status: int, body: bytes = b"", content_type: str = "text/html; charset=utf-8",
+              headers: tuple[tuple[str, str], ...] = ()):
+        self.send_response(status)
+        for name, value in (("Content-Type", content_type), ("Content-Length", str(len(body)))) + headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes["sent"] += len(body) + \
+                sum(len(name) + len(value) + 4 for name, value in headers)
+
+    def redirect(self, location: str, headers: tuple[tuple[str, str], ...] = ()):
+        self.reply(303, headers=(("Location", location),) + headers)
+
+    def reply_json(self, payload):
+        self.reply(200, json.dumps(payload).encode(), "application/json")
+
+    def reply_page(self, html: str):
+        """
+        Pages carry an ETag so that an unchanged page is answered with a 304.
+        """
+        body = html.encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304, headers=(("ETag", etag),))
+        self.reply(200, body, headers=(("ETag", etag),))
+
+    def prepare(self) -> Optional[bytes]:
+        """
+        Common part of GET and POST: counting, latency and failure injection, returns None when the request was failed.
+        """
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlsplit(self.path).path
+        with self.server.lock:
+            self.server.requests[path] += 1
+            self.server.bytes["received"] += len(body) + len(str(self.headers))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            with self.server.lock:
+                self.server.failures += 1
+            self.reply(503, b"Service Unavailable", "text/plain")
+            return None
+        return body
+
+    def do_GET(self):
+        if self.prepare() is None:
+            return
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/cas/login":
+            return self.reply(200, f'<form><input type="hidden" name="execution" value="{secrets.token_hex(8)}"/>'
+                              f'<input name="_eventId" value="submit"/></form>'.encode())
+        if url.path == "/login/index.php" and "ticket" in query:
+            cookies = secrets.token_hex(13), secrets.token_hex(13)
+            self.server.sessions["/".join(cookies)] = secrets.token_hex(5)
+            return self.redirect(f"{MOODLE_URL}/my/", (("Set-Cookie", f"MoodleSession={cookies[0]}; path=/; HttpOnly"),
+                                                        ("Set-Cookie", f"BNES_MoodleSession={cookies[1]}; path=/")))
+        sesskey = self.session_key()
+        if sesskey is None:
+            return self.redirect(f"{MOODLE_URL}/login/index.php")
+        if url.path == "/my/":
+            return self.reply(200, f'<html><body><a href="/message/output/popup/notifications.php">notifications</a>'
+                              f'<input type="hidden" name="sesskey" value="{sesskey}"/></body></html>'.encode())
+        if url.path == "/course/view.php":
+            return self.reply_page(course_page(int(query["id"][0]), self.server.assignments_per_course))
+        if url.path == "/mod/assign/view.php":
+            return self.reply_page(assignment_page(int(query["id"][0])))
+        self.reply(404, b"Not Found", "text/plain")
+
+    def do_POST(self):
+        body = self.prepare()
+        if body is None:
+            return
+        url = urlsplit(self.path)
+        if url.path == "/cas/login":
+            form = parse_qs(body.decode())
+            if not (form.get("username") and form.get("password") and form.get("execution")):
+                return self.reply(401, b"<html>Invalid credentials</html>")
+            return self.redirect(f"{MOODLE_URL}/login/index.php?ticket=ST-{secrets.token_hex(6)}")
+        if url.path == "/lib/ajax/service.php":
+            return self.service(parse_qs(url.query).get("sesskey", [""])[0], json.loads(body))
+        self.reply(404, b"Not Found", "text/plain")
+
+    def service(self, sesskey: str, payload: list[dict]):
+        """
+        Moodle answers a wrong sesskey with a dict and an expired session with an error entry in the list.
+        """
+        if sesskey != self.session_key():
+            return self.reply_json({"error": "Invalid sesskey", "errorcode": "invalidsesskey"})
+        call = payload[0]
+        method, args = call["methodname"], call["args"]
+        data: dict[str, Any]
+        if method == "core_session_time_remaining":
+            data = {"userid": 1, "timeremaining": 7200}
+        elif method == "message_popup_get_popup_notifications":
+            offset, limit = args.get("offset", 0), args.get("limit", 0)
+            page = self.server.notifications[offset:offset +
+                                             limit if limit else None]
+            data = {"notifications": page, "unreadcount": 0}
+        elif method == "core_course_get_enrolled_courses_by_timeline_classification":
+            data = {"courses": self.server.courses, "nextoffset": len(
+                self.server.courses)}
+        else:
+            return self.reply_json([{"error": True, "exception": {"message": f"unknown method {method}"}}])
+        self.reply_json([{"error": False, "data": data}])
+
+
+class LocalTransport(httpx.AsyncBaseTransport):
+    """
+    Sends requests for the real CAS and moodle hosts to the stand-in server instead, the client keeps seeing the
+    real urls so cookies, redirects and the login checks behave exactly as they do against the real site.
+    """
+
+    def __init__(self, address: str) -> None:
+        self.address = httpx.URL(address)
+        self.transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host in (CAS_HOST, MOODLE_HOST):
+            request = httpx.Request(request.method, request.url.copy_with(scheme=self.address.scheme, host=self.address.host,
+                                                                          port=self.address.port),
+                                    headers=request.headers, content=await request.aread(), extensions=request.extensions)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notifications", type=int, default=100)
+    parser.add_argument("--courses", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="share of requests answered with a 503")
+    args = parser.parse_args()
+    with FakeMoodle(canned_notifications(args.notifications), canned_courses(args.courses),
+                    latency=args.latency, failure_rate=args.failure_rate) as server:
+        print(f"serving on {server.address}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
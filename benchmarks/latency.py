@@ -0,0 +1,149 @@
+"""
+Reply latency of cheap commands (whatis, help, agenda) on the asyncio bot, in three situations:
+    idle            nothing else is going on
+    refresh         a full refresh runs against the local stand-in server (benchmarks/fake_moodle.py)
+    heavy commands  large replies (important, filter, search) are being built at the same time
+Commands go through idle.language_interpreter the way telegram updates do, each one in a task of its own,
+and a reply is timed until it is handed to the outgoing queue (sending it to telegram is replaced with a no-op).
+The bot runs in a temporary data directory so the real bot_data_stuff is never touched.
+
+    python3 benchmarks/latency.py --notifications 5000 --commands 200
+"""
+import argparse
+import asyncio
+import json
+import pathlib
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import Future
+from datetime import datetime
+
+BENCHMARKS = pathlib.Path(__file__).resolve().parent
+sys.path[:0] = [str(BENCHMARKS.parent), str(BENCHMARKS)]
+from corpus import calendar_text, make_courses, make_notifications  # noqa: E402
+from fake_moodle import FakeMoodle, LocalTransport  # noqa: E402
+from refresh import make_data_dir  # noqa: E402
+
+CHEAP_COMMANDS = ("whatis comp210", "help", "agenda 3 days")
+HEAVY_COMMANDS = ("important", "filter quiz", "search quiz", "agenda past 5 years")
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    # inclusive: the exclusive default extrapolates past the largest sample on small runs
+    cuts = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    return {"count": len(samples), "p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": max(samples)}
+
+
+def start_refresh() -> Future:
+    import idle
+    idle.refresh_interface()
+    if idle.current_refresh is None:
+        raise RuntimeError("the refresh did not start")
+    return idle.current_refresh
+
+
+async def timed_command(text: str) -> float:
+    import idle
+    start = time.perf_counter()
+    await idle.language_interpreter(types.SimpleNamespace(text=text, chat=types.SimpleNamespace(id=idle.chat_id)))
+    return time.perf_counter() - start
+
+
+async def cheap_latencies(count: int, interval: float, while_running=lambda: True) -> list[float]:
+    """
+    Sends count cheap commands interval seconds apart, stops early once while_running turns False.
+    """
+    tasks = []
+    for i in range(count):
+        if not while_running():
+            break
+        tasks.append(asyncio.create_task(
+            timed_command(CHEAP_COMMANDS[i % len(CHEAP_COMMANDS)])))
+        await asyncio.sleep(interval)
+    return list(await asyncio.gather(*tasks))
+
+
+async def during_refresh(count: int, interval: float) -> tuple[list[float], float]:
+    from utilities.store import get_store
+    # forget everything (the parsed deadlines are stored with the announcements) so the refresh downloads
+    # and parses the whole history again
+    get_store().write("DELETE FROM announcements", [()])
+    start = time.perf_counter()
+    refresh = start_refresh()
+    latencies = await cheap_latencies(count, interval, lambda: not refresh.done())
+    await asyncio.wrap_future(refresh)
+    return latencies, time.perf_counter() - start
+
+
+async def during_heavy_commands(count: int, interval: float) -> list[float]:
+    done = False
+
+    async def heavy():
+        i = 0
+        while not done:
+            await timed_command(HEAVY_COMMANDS[i % len(HEAVY_COMMANDS)])
+            i += 1
+    background = [asyncio.create_task(heavy()) for _ in range(2)]
+    latencies = await cheap_latencies(count, interval)
+    done = True
+    await asyncio.gather(*background)
+    return latencies
+
+
+async def run(server: FakeMoodle, count: int, interval: float) -> dict:
+    import idle
+    from utilities.message_queue import MessageQueue
+    from utilities.moodle_session import MoodleSession
+
+    async def new_session():
+        return MoodleSession(transport=LocalTransport(server.address))
+    idle.configure()
+    idle.bot_loop = asyncio.get_running_loop()
+    # no rate limits, nothing is actually sent
+    idle.outbox = MessageQueue(lambda chat, text: None, chat_rate=1e9, chat_burst=1e9,
+                               global_rate=1e9, global_burst=1e9)
+    idle.outbox.start()
+    idle.start_refresh_loop()
+    # the refresh's client lives on the refresh loop
+    idle.moodle_session = asyncio.run_coroutine_threadsafe(
+        new_session(), idle.refresh_loop).result()
+    await asyncio.wrap_future(start_refresh())
+    await asyncio.get_running_loop().run_in_executor(None, idle.warm_up)
+
+    results = {"idle": percentiles(await cheap_latencies(count, interval))}
+    latencies, seconds = await during_refresh(count, interval)
+    results["refresh"] = percentiles(latencies) | {"refresh_seconds": seconds}
+    results["heavy commands"] = percentiles(await during_heavy_commands(count, interval))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notifications", type=int, default=2000)
+    parser.add_argument("--commands", type=int, default=200,
+                        help="cheap commands per situation (fewer if the refresh ends first)")
+    parser.add_argument("--interval", type=float, default=0.01,
+                        help="seconds between two cheap commands")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the server waits before every response")
+    args = parser.parse_args()
+    make_data_dir()
+    from utilities import semester_utils
+    from utilities.common import setup_logging
+    setup_logging()
+    # "week 7" deadlines need the calendar pdf, parse a synthetic one instead of downloading it
+    calendar = semester_utils._make_meta_info(
+        calendar_text(datetime.now().year))
+    semester_utils.semester_info = lambda: calendar
+    import idle
+    idle.semester_info = semester_utils.semester_info
+    with FakeMoodle(make_notifications(args.notifications), make_courses(), latency=args.latency) as server:
+        results = asyncio.run(run(server, args.commands, args.interval))
+    print(json.dumps({"benchmark": "latency", "notifications": args.notifications, "interval": args.interval,
+                      "latency": args.latency, "seconds": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
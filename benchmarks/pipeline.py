@@ -0,0 +1,144 @@
+"""
+Times every stage between the stored notifications and a reply on synthetic corpora (benchmarks/corpus.py):
+the store upsert, get_data (with a cold and a warm parse cache), annotate_changes, notification_cleanup, TelegramInterface
+construction, search_notifications, filter_by_type_worker (through the store and through the columnar table)
+and notification_message_builder.
+The bot runs in a temporary data directory so the real bot_data_stuff is never touched.
+
+Results are json, keep one around and compare against it to spot regressions:
+    python3 benchmarks/pipeline.py --sizes 100,1000,10000 --output baseline.json
+    python3 benchmarks/pipeline.py --sizes 100,1000,10000 --compare baseline.json --tolerance 0.2
+--compare exits with 1 when a stage got slower than the tolerance allows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCHMARKS = pathlib.Path(__file__).resolve().parent
+sys.path[:0] = [str(BENCHMARKS.parent), str(BENCHMARKS)]
+from corpus import calendar_text, make_notifications, write_data_dir  # noqa: E402
+
+SEARCH_QUERIES = ("quiz", "zoom", '"will be held"', "exam tomorrow")
+FILTER_QUERIES = ("quiz", "lab", "project", "comp210", "databases", "recent")
+
+
+def time_stage(function, runs: int) -> dict[str, float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return {"median": statistics.median(samples), "min": min(samples)}
+
+
+def bench_size(size: int, runs: int) -> dict[str, dict[str, float]]:
+    from functions import TelegramInterface, notification_message_builder
+    from utilities.async_functions import get_data
+    from utilities.input_filters import annotate_changes, notification_cleanup
+    from utilities.store import get_store
+
+    store = get_store()
+    store.write("DELETE FROM announcements", [()])
+    stages = {"store upsert": time_stage(
+        lambda: store.upsert_notifications(make_notifications(size)), 1)}
+    rows = store.unparsed()
+    stages["get_data (cold parse cache)"] = time_stage(
+        lambda: asyncio.run(get_data(rows, use_cache=False)), runs)
+    # the parse cache is the deadlines and parse keys annotate stores
+    stages["annotate_changes (everything new)"] = time_stage(
+        lambda: asyncio.run(annotate_changes(store)), 1)
+    stages["annotate_changes (nothing new)"] = time_stage(
+        lambda: asyncio.run(annotate_changes(store)), runs)
+    rows = store.notifications()
+    stages["get_data (warm parse cache)"] = time_stage(
+        lambda: asyncio.run(get_data(rows)), runs)
+    objects = asyncio.run(get_data(rows))
+    stages["notification_cleanup"] = time_stage(
+        lambda: notification_cleanup(objects), runs)
+    for name, columnar in (("", False), (" (columnar)", True)):
+        stages[f"TelegramInterface{name}"] = time_stage(
+            lambda: TelegramInterface(columnar=columnar), runs)
+        interface = TelegramInterface(columnar=columnar)
+        stages[f"filter_by_type_worker{name}"] = time_stage(
+            lambda: [list(interface.filter_by_type_worker(i) or ()) for i in FILTER_QUERIES], runs)
+    stages["search_notifications"] = time_stage(
+        lambda: [interface.search_notifications(i) for i in SEARCH_QUERIES], runs)
+    stages["notification_message_builder"] = time_stage(
+        lambda: [notification_message_builder(i) for i in objects], runs)
+    return stages
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """
+    A stage regressed when its min time grew by more than tolerance (0.2 -> 20%) over the baseline's.
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, seconds in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if before and seconds["min"] > before["min"] * (1 + tolerance):
+                regressions.append({"size": size, "stage": stage, "baseline": before["min"], "now": seconds["min"],
+                                    "ratio": seconds["min"] / before["min"]})
+    return regressions
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS.parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="comma separated corpus sizes, up to 100000")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", type=pathlib.Path,
+                        help="also write the results to this file")
+    parser.add_argument("--compare", type=pathlib.Path,
+                        help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    sizes = [int(i) for i in args.sizes.split(",")]
+
+    # the data directory is resolved from the working directory when the bot modules are imported
+    root = pathlib.Path(tempfile.mkdtemp(prefix="bau-pipeline-"))
+    write_data_dir(root / "bot_data_stuff", 0)
+    os.chdir(root)
+    from utilities import semester_utils
+    from utilities.common import setup_logging
+    setup_logging()
+    # "week 7" deadlines need the calendar pdf, parse a synthetic one instead of downloading it
+    calendar = semester_utils._make_meta_info(
+        calendar_text(datetime.now().year))
+    semester_utils.semester_info = lambda: calendar
+
+    results = {str(size): bench_size(size, args.runs)
+               for size in sizes}
+    report = {"benchmark": "pipeline", "revision": git_revision(), "python": platform.python_version(),
+              "runs": args.runs, "seconds": results}
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["seconds"]
+        report["regressions"] = find_regressions(
+            results, baseline, args.tolerance)
+    output = json.dumps(report, indent=4)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+End-to-end refresh benchmark against the local stand-in server (benchmarks/fake_moodle.py), nothing talks to the real site.
+
+Scenarios, in the order a long running bot meets them:
+    cold refresh      no saved session and no stored notifications: the CAS login and a full sync
+    warm refresh      a new process with the saved session and the stored notifications: a delta sync
+    expired refresh   the server forgot every session: the saved one is rejected and CAS is walked again
+    cold assignments  find_assignments with an empty http cache
+    warm assignments  find_assignments again, unchanged pages come back as 304s
+Each reports the wall time, the requests per path and the bytes sent and received by the server.
+The bot runs in a temporary data directory so the real bot_data_stuff is never touched.
+
+Run it from anywhere:
+    python3 benchmarks/refresh.py --runs 5 --latency 0.05 --failure-rate 0.02
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS = pathlib.Path(__file__).resolve().parent
+sys.path[:0] = [str(BENCHMARKS.parent), str(BENCHMARKS)]
+from fake_moodle import FakeMoodle, LocalTransport, canned_courses, canned_notifications  # noqa: E402
+
+FAKE_CREDS = "student\nhunter2\n0:fake-token\n-1\n-2"
+# every file the bot writes, removed before a cold run
+BOT_FILES = ("bot.sqlite3", "bot.sqlite3-wal", "bot.sqlite3-shm", "session.json", "http_cache.json")
+
+
+def make_data_dir() -> pathlib.Path:
+    """
+    The data directory is resolved from the working directory when utilities.common is imported,
+    so this has to run before the bot modules are imported.
+    """
+    root = pathlib.Path(tempfile.mkdtemp(prefix="bau-refresh-"))
+    (root / "bot_data_stuff").mkdir()
+    (root / "bot_data_stuff" / "creds.txt").write_text(FAKE_CREDS)
+    (root / "bot_data_stuff" / "settings.cfg").write_text("testing=true")
+    os.chdir(root)
+    return root / "bot_data_stuff"
+
+
+async def measure(server: FakeMoodle, coroutine) -> dict:
+    server.reset()
+    start = time.perf_counter()
+    error = None
+    try:
+        await coroutine
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "requests": sum(server.requests.values()), "requests_per_path": dict(server.requests),
+            "bytes": dict(server.bytes), "injected_failures": server.failures, "error": error}
+
+
+async def run_once(server: FakeMoodle, data_dir: pathlib.Path) -> dict[str, dict]:
+    import endpoint
+    from utilities.async_functions import find_assignments
+    from utilities.moodle_session import MoodleSession
+    from utilities.store import get_store
+
+    def new_session() -> MoodleSession:
+        # a fresh session is a fresh process as far as moodle can tell, only the files on disk carry over
+        return MoodleSession(transport=LocalTransport(server.address))
+
+    async def with_session(work):
+        session = new_session()
+        try:
+            await work(session)
+        finally:
+            # a failed gather leaves the sibling requests in flight, closing must not hide the original error
+            with contextlib.suppress(RuntimeError):
+                await session.close()
+
+    def refresh():
+        return with_session(endpoint.main)
+
+    def assignments():
+        return with_session(find_assignments)
+
+    # the store keeps its file open
+    get_store().close()
+    get_store.cache_clear()
+    for i in BOT_FILES:
+        (data_dir / i).unlink(missing_ok=True)
+    results = {"cold refresh": await measure(server, refresh()),
+               "warm refresh": await measure(server, refresh())}
+    server.expire_sessions()
+    results["expired refresh"] = await measure(server, refresh())
+    (data_dir / "http_cache.json").unlink(missing_ok=True)
+    results["cold assignments"] = await measure(server, assignments())
+    results["warm assignments"] = await measure(server, assignments())
+    return results
+
+
+def summarize(runs: list[dict[str, dict]]) -> dict[str, dict]:
+    """
+    Median and min wall time over the runs, the counters are the medians too (they only vary with injected failures).
+    """
+    summary = {}
+    for scenario in runs[0]:
+        samples = [i[scenario] for i in runs]
+        summary[scenario] = {
+            "seconds": {"median": statistics.median(i["seconds"] for i in samples), "min": min(i["seconds"] for i in samples)},
+            "requests": statistics.median(i["requests"] for i in samples),
+            "bytes_sent": statistics.median(i["bytes"]["sent"] for i in samples),
+            "bytes_received": statistics.median(i["bytes"]["received"] for i in samples),
+            "requests_per_path": samples[-1]["requests_per_path"],
+            "injected_failures": sum(i["injected_failures"] for i in samples),
+            "errors": [i["error"] for i in samples if i["error"]]}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--notifications", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=6)
+    parser.add_argument("--assignments", type=int, default=3,
+                        help="assignments per course")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the server waits before every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="share of requests answered with a 503")
+    args = parser.parse_args()
+    data_dir = make_data_dir()
+    from utilities.common import setup_logging
+    setup_logging()
+    with FakeMoodle(canned_notifications(args.notifications), canned_courses(args.courses), args.assignments,
+                    latency=args.latency, failure_rate=args.failure_rate) as server:
+        runs = [asyncio.run(run_once(server, data_dir))
+                for _ in range(args.runs)]
+    print(json.dumps({"benchmark": "refresh", "runs": args.runs, "notifications": args.notifications,
+                      "courses": args.courses, "assignments_per_course": args.assignments, "latency": args.latency,
+                      "failure_rate": args.failure_rate, "scenarios": summarize(runs)}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
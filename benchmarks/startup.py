@@ -0,0 +1,64 @@
+"""
+Startup benchmark: cold import time of the bot modules and the time it takes the bot to send its first reply.
+Every run happens in a fresh interpreter so nothing is cached between runs.
+
+Run it from the repository root (the data directory is relative to it):
+    python3 benchmarks/startup.py --runs 5 > bench_output.txt
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT_ONLY = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import": time.perf_counter() - start}}))
+"""
+
+FIRST_REPLY = """
+import asyncio, json, time, types
+start = time.perf_counter()
+import idle
+imported = time.perf_counter()
+idle.configure()
+replies = []
+idle.outbox.send = lambda chat, text: replies.append(time.perf_counter())
+idle.outbox.start()
+asyncio.run(idle.language_interpreter(types.SimpleNamespace(text={command!r}, chat=types.SimpleNamespace(id=idle.chat_id))))
+idle.outbox.join()
+print(json.dumps({{"import": imported - start, "first_reply": replies[0] - start}}))
+"""
+
+
+def run_child(code: str) -> dict[str, float]:
+    result = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+    return {key: {"median": statistics.median(i[key] for i in samples), "min": min(i[key] for i in samples)}
+            for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--command", default="whatis comp210",
+                        help="the command whose reply is timed")
+    args = parser.parse_args()
+    results = {}
+    for module in ("utilities.common", "functions", "idle"):
+        results[f"import {module}"] = summarize(
+            [run_child(IMPORT_ONLY.format(module=module)) for _ in range(args.runs)])
+    results["first reply"] = summarize(
+        [run_child(FIRST_REPLY.format(command=args.command)) for _ in range(args.runs)])
+    print(json.dumps({"benchmark": "startup", "runs": args.runs,
+          "seconds": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,83 @@
 import itertools
-from typing import Iterable
-from functools import reduce
-from utilities.common import Announcement, bool_return, checker_factory, clean_iter, flatten_iter, json, autocorrect, string_builder, IO_DATA_DIR, to_natural_str
-from utilities.input_filters import notification_cleanup, ALL_NOTIFICATIONS
-from utilities.time_parsing_lib import now, datetime
+from datetime import date, timedelta
+import sqlite3
+from typing import Callable, Iterable, Mapping, Optional
+from utilities.announcement_table import AnnouncementTable
+from utilities.common import Announcement, bool_return, clean_iter, string_builder, to_natural_str
+from utilities.search_index import FuzzyIndex, fts_query, highlight
+from utilities.store import DEADLINE_FORMAT, Store, announcement_from_row, get_store
+from utilities.time_parsing_lib import datetime, relative_range
 
 
 def notification_message_builder(
         notification: Announcement, custom_message=None):
+    # "days left" only changes with the day, the text is built once a day per announcement (unless it is highlighted)
+    key = (date.today(), notification.deadline, notification.subject)
+    if custom_message is None and notification.rendered and notification.rendered[0] == key:
+        return notification.rendered[1]
     attrs = ("title", "subject", "message", "deadline")
     strings = [getattr(notification, attr)
                for attr in attrs]
     prefixes = [i.capitalize() for i in attrs]
     strings.append(to_natural_str(notification.date_created))
     if strings[-2]:
-        strings[-2] += f"  ({( (datetime.strptime(strings[-2],'%A %B %d %Y')) - now ).days }days left)"
+        strings[-2] += f"  ({( (datetime.strptime(strings[-2], DEADLINE_FORMAT)) - datetime.now() ).days }days left)"
     prefixes.append("Time created")
     if custom_message:
         strings[2] = custom_message
 
-    return f"""
+    text = f"""
     ---------------------------------------
         {string_builder(strings,prefixes)}
     ---------------------------------------
 
     """
+    if custom_message is None:
+        notification.rendered = (key, text)
+    return text
 
 
-def search_case_insensitive(query: str, text: str):
-    query = query.lower()
-    found = [(q, f"[{q}]") for q in (
-        query, query.capitalize(), query.upper()) if q in text]
-    # *v here prevents another loop; semantically equivalent to for item in found: reduce(lambda s,v : s.replace(v), found , text where text is the default in case no results were found )
-    result = reduce(lambda s, v: s.replace(*v), found, text)
-    if result != text:
-        return result
+def announcements(rows: Iterable[sqlite3.Row]) -> list[Announcement]:
+    return [announcement_from_row(i) for i in rows]
 
 
 class TelegramInterface:
-    def __init__(self) -> None:
+    """
+    Every command reads what it needs from the store when it runs (its indexed queries and full text search), only the
+    courses are kept here. With the columnar table (the columnar_filters setting) filtering by course, type or recency
+    is a mask over the table's columns instead and only the matching announcements are read.
+    """
+
+    def __init__(self, store: Optional[Store] = None, columnar: bool = False) -> None:
         exam_types: dict[str, str] = dict.fromkeys(
             ("quiz", "test", "exam", "grades", "exams", "quizzes", "tests"), "exam")
         non_exam_types = dict.fromkeys(("lab", "labs"), "lab") | dict.fromkeys(
             ("project", "projects"), "project")
         overall_types = exam_types | non_exam_types
         self.overall_types = overall_types
-        self.unfiltered_notifications: tuple[Announcement] = ALL_NOTIFICATIONS
-        self.notifications = notification_cleanup(
-            self.unfiltered_notifications)
-        self.course_mappings_dict: dict[str, str] = json.loads(
-            IO_DATA_DIR("mappings.json"))
+        self.store = store if store is not None else get_store()
+        self.table = AnnouncementTable(self.store.columns()) if columnar else None
+        self.course_mappings_dict: Mapping[str, str] = self.store.mappings()
         self.stripped_course_numbers = list(map(lambda x: x.split(
             "-")[0].lower(), self.course_mappings_dict.values()))
+        # course codes and names -> position in course_mappings_dict
+        self.course_index = FuzzyIndex(itertools.chain.from_iterable(
+            ((code, i), (name, i)) for i, (code, name) in enumerate(self.course_mappings_dict.items())))
         self.update_links_and_meetings()
 
     def update_links_and_meetings(self):
-        existing_links = IO_DATA_DIR("links_and_meetings.json")
-        if existing_links:
-            try:
-                existing_links = json.loads(existing_links)
-            except json.decoder.JSONDecodeError:
-                existing_links = None
-        notifications = {
-            announcement.subject: announcement.links
-            for announcement in self.unfiltered_notifications
-            if announcement.links and announcement.subject_type}
-        if isinstance(existing_links, dict):
-            notifications |= existing_links
-        notifications = json.dumps(notifications, indent=4)
-        IO_DATA_DIR("links_and_meetings.json", "w", notifications)
+        # only announcements that are new or were edited since the last call are scanned
+        self.store.scan_links()
 
     def get_index_from_name(self, query: str):
-        query = query.replace(" ", "").strip()
-        reference_tuple = tuple(
-            map(lambda tup: (tup[0].lower().split("-")[0], tup[1].lower()), self.course_mappings_dict.items()))
-        try:
-            index = None
-            if query == "":
-                raise TypeError
-            for i, j in zip(reference_tuple, range(len(reference_tuple))):
-                if query in i[0] or query in i[1]:
-                    index = j
-            if index is None:
-                try:
-                    reference_tuple = flatten_iter(reference_tuple)
-                    index = reference_tuple.index(
-                        autocorrect(reference_tuple, query, ratio=0.75))
-                except (ValueError, IndexError):
-                    index = None
-            return index
-
-        except TypeError:
-            return None
+        """
+        Position of the course whose code or name contains the query, or failing that is the most similar to it.
+        """
+        match = self.course_index.best(query, ratio=0.75, substrings=True)
+        return None if match is None else match[0]
 
     def get_name_from_index(self, index: int):
-        if index:
+        if index is not None:
             return self.course_mappings_dict[tuple(self.course_mappings_dict.keys())[index]]
 
     def name_wrapper(self, query: str):
@@ -103,20 +86,43 @@ class TelegramInterface:
             index = self.get_index_from_name(query)
             return bool_return(self.get_name_from_index(index), query)
 
-    def autoremind_worker(self):
-
-        is_relatively_recent = checker_factory(0, 7)
-        return filter(is_relatively_recent, self.notifications)
+    def important_worker(self) -> list[Announcement]:
+        """
+        Important announcements, newest first.
+        """
+        return announcements(self.store.important())
+
+    def autoremind_worker(self) -> list[Announcement]:
+        """
+        Important announcements whose deadline is at most a week away.
+        """
+        return self.agenda_worker("") or []
+
+    def agenda_worker(self, query: str) -> list[Announcement] | None:
+        """
+        Deadlines from today up to the end of the range ("3 days", "next month", a week by default), soonest first,
+        or announcements posted since the start of a backwards range ("past 2 weeks"), newest first.
+        None if the query is not a range.
+        """
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        parsed = relative_range(query, today)
+        if parsed is None:
+            return None
+        backwards, end = parsed
+        if backwards:
+            return announcements(self.store.created_since(int(end.timestamp())))
+        return announcements(self.store.deadlines_between(today, end))
 
     def search_notifications(self, query: str) -> str | None:
-        def _search_announcement(announcement: Announcement, query: str):
-            msg = announcement.message.lower()
-            highlighted_string = search_case_insensitive(
-                query, announcement.message)
-            if msg and highlighted_string:
-                return notification_message_builder(announcement, custom_message=highlighted_string)
-        messages: list[Announcement] = clean_iter((_search_announcement(i, query)
-                                                   for i in ALL_NOTIFICATIONS), list)
+        """
+        Every term has to appear in the message (terms also match longer words) and "quoted phrases" have to appear as is.
+        """
+        def _search_announcement(announcement: Announcement):
+            if announcement.message:
+                return notification_message_builder(announcement, custom_message=highlight(query, announcement.message))
+        match = fts_query(query)
+        messages: list[str] = clean_iter((_search_announcement(announcement_from_row(i))
+                                          for i in self.store.search(match)), list) if match else []
         if query:
             if len(messages) > 1:
                 messages_str = string_builder(
@@ -125,7 +131,7 @@ class TelegramInterface:
                 messages_str = f"{messages_str}\n{prompt}"
                 return messages_str
             elif len(messages) == 1:
-                return messages[0].message
+                return messages[0]
 
         return None
 
@@ -133,26 +139,31 @@ class TelegramInterface:
 
         def _traditional_types():
             course_mappings = self.course_mappings_dict
-            messages = self.unfiltered_notifications
             processed_message = ""
             try:
                 processed_message = self.name_wrapper(query)
             except TypeError:
                 processed_message = None
 
-            def subjects_codes_condition(x):
-                return course_mappings[x.subject_code.split(":")[0]] == processed_message
-
-            def subjects_types_condition(
-                x): return self.overall_types[processed_message] in x.subject_type
-
             if processed_message in itertools.chain.from_iterable(course_mappings.items()):
-                return filter(subjects_codes_condition, messages)
+                codes = [code for code, name in course_mappings.items()
+                         if processed_message in (code, name)]
+                return self.select(lambda: self.store.by_subject_codes(codes), codes=codes)
             elif processed_message in self.overall_types:
-                return filter(subjects_types_condition, messages)
+                kind = self.overall_types[processed_message]
+                return self.select(lambda: self.store.by_type(kind), kinds=[kind])
 
         if query == "recent":
-            f = checker_factory(0, 7)
-            return filter(lambda dt:  f((now - dt.date_created).days), self.unfiltered_notifications)
-        else:
-            return _traditional_types()
+            # posted at most 7 (whole) days ago
+            week_ago = int((datetime.now() - timedelta(days=8)).timestamp())
+            return self.select(lambda: self.store.created_since(week_ago), created_after=week_ago)
+        return _traditional_types()
+
+    def select(self, query: Callable[[], list[sqlite3.Row]], **conditions) -> list[Announcement]:
+        """
+        The rows of the store's query, or with the columnar table the rows of the ids matching the same conditions
+        (see AnnouncementTable.mask).
+        """
+        if self.table is None:
+            return announcements(query())
+        return announcements(self.store.by_ids(self.table.select(self.table.mask(**conditions))))
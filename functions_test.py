@@ -1,12 +1,30 @@
-from datetime import datetime, timedelta
+import asyncio
+from datetime import date, datetime, timedelta
+import difflib
+import io
+import os
+import pathlib
 import re
+import tempfile
 from types import FunctionType
 from typing import Iterable, Optional
 import unittest
-from functions import TelegramInterface
-from utilities.async_functions import prep_courses, datefinder
-from utilities.common import coerce_to_none, flattening_iterator, my_format, pad_iter, run, to_natural_str
-from utilities.time_parsing_lib import RelativeDate
+import httpx
+from functions import TelegramInterface, notification_message_builder
+from utilities.announcement_table import AnnouncementTable
+from utilities import semester_utils
+from utilities import async_functions
+from utilities.async_functions import parse_deadlines, prep_courses, datefinder
+from utilities.common import MESSAGE_SEPARATOR, Announcement, cached_json_handler, coerce_to_none, flattening_iterator, high_water_mark, is_unseen, my_format, pad_iter, run, to_natural_str
+from utilities.chat_sessions import ChatSessions
+from utilities.classifier import classify
+from utilities.crawler import ConditionalFetcher
+from utilities.message_queue import MessageQueue
+from utilities.reminders import ReminderScheduler
+from utilities.search_index import FuzzyIndex, fts_query, highlight
+from utilities.input_filters import annotate_changes, sketch_ratio, title_sketch
+from utilities.store import Store, announcement_from_row
+from utilities.time_parsing_lib import RelativeDate, relative_range
 
 
 def begin_test(obj: unittest.TestCase, cases: list, assertions: tuple, function: FunctionType = None, messages: Optional[Iterable[str]] = None):
@@ -145,8 +163,359 @@ class SanityChecks(unittest.TestCase):
                              ({"exam"}, {"exam"}, set(),  {"lab", "exam"}, {"exam"}, {"exam"}, {"project"}, {"lab", "session"}, {"session"}))
         begin_test(self, cases, assertions, generate_subjects)
 
+    def test_title_sketch(self):
+        # postponed notices against the titles they would supersede, as the cleanup compares them (lowercase)
+        pairs = (("COMP210: Quiz 2 postponed", "COMP210: Quiz 2"), ("MATH281: Midterm exam postponed to Tuesday", "MATH281: Midterm exam"),
+                 ("COMP208: Lab session postponed", "COMP208: Lab exam on Monday"), ("COMP210: Project deadline extended", "COMP210: Final project"),
+                 ("BLAW001: Quiz postponed", "BLAW001: Grades of the quiz"), ("", ""))
+        cases, assertions = [], []
+        for first, second in pairs:
+            first, second = first.lower(), second.lower()
+            cases.append(sketch_ratio(title_sketch(first), title_sketch(second), len(first) + len(second)))
+            assertions.append(difflib.SequenceMatcher(None, first, second).quick_ratio())
+        begin_test(self, cases, tuple(assertions), messages=(f"Should match quick_ratio for {i}" for i in pairs))
 
-t = TelegramInterface()
+    def test_parse_deadlines(self):
+        messages = ("Quiz on Monday 14 March", "Exam in 3 days", "Project due week 7", "Quiz next week",
+                    "Lab on Sunday", "Exam postponed to Tuesday 22 March", "Project presentation tomorrow")
+        announcements = [Announcement(f"COMP210: {i}", f"COMP210: {i}{MESSAGE_SEPARATOR}{i}", 1646000000 + n * 86400)
+                         for n, i in enumerate(messages * 3)]
+        # the pool's workers get the stub's calendar, so nothing downloads the calendar pdf
+        original = semester_utils.semester_info
+        calendar = semester_utils._make_meta_info("".join(
+            f"2-Feb-{i % 100}Springsemesterbeginsforallfaculties1-Jul-{i % 100}Summersessionbegins"
+            f"5-Sep-{i % 100}Fallsemesterbeginsforallfaculties" for i in (semester_utils.now.year - 1, semester_utils.now.year)))
+        semester_utils.semester_info = lambda: calendar
+        try:
+            threaded = run(parse_deadlines(announcements))
+            pooled = run(parse_deadlines(
+                announcements, processes=2, chunk_size=4))
+        finally:
+            semester_utils.semester_info = original
+        cases = (pooled, len(pooled), threaded[4])
+        assertions = (threaded, len(announcements), None)
+        messages = ("Should match the thread path in the input order", "Should return a deadline per announcement",
+                    "Should skip announcements without deadlines")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_parse_cache(self):
+        store = Store(":memory:")
+
+        def notification(i: int, title: str, message: str):
+            return {"id": i, "timecreated": i, "subject": title, "fullmessage": f"{title}{MESSAGE_SEPARATOR}{message}"}
+        store.upsert_notifications([notification(1, "COMP210: Quiz", "on Monday"), notification(2, "COMP210: Quiz 2", "on Tuesday")])
+        parsed = []
+
+        def find_deadlines(announcements):
+            # every batch gets a later deadline, a stored deadline shows which batch parsed it
+            parsed.append([i.id for i in announcements])
+            return [datetime(2022, 3, 21 + len(parsed))] * len(announcements)
+        original = async_functions.find_deadlines
+        async_functions.find_deadlines = find_deadlines
+        try:
+            counts = [run(annotate_changes(store)), run(annotate_changes(store))]
+            store.upsert_notifications([notification(1, "COMP210: Quiz", "moved to Wednesday"),
+                                        notification(3, "COMP210: Quiz 2 postponed", "to next week")])
+            counts.append(run(annotate_changes(store)))
+        finally:
+            async_functions.find_deadlines = original
+        cases = (counts, parsed, [(i["id"], i["deadline"]) for i in store.created_since(0)], [i["id"] for i in store.by_type("exam")])
+        assertions = ([2, 0, 2], [[2, 1], [3, 1]], [(3, "2022-03-23"), (2, "2022-03-22"), (1, "2022-03-23")], [3, 1])
+        messages = ("Should count the parsed announcements", "Should only parse new and edited announcements",
+                    "Should keep the stored deadlines of the others", "Should clean up the courses that changed")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_json_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory)
+            load = cached_json_handler(path)
+            file = path.joinpath("cache.json")
+            file.write_text('{"etag": 1}')
+            first, second = load("cache.json"), load("cache.json")
+            # same size, only the mtime tells the rewrite apart
+            stat = file.stat()
+            file.write_text('{"etag": 2}')
+            os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            cases = (first is second, load("cache.json")["etag"])
+        assertions = (True, 2)
+        messages = ("Should parse an unchanged file once", "Should reload a file rewritten with a new mtime")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_conditional_fetcher(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/down":
+                raise httpx.ConnectError("unreachable", request=request)
+            if request.url.path == "/slow":
+                raise httpx.ReadTimeout("timed out", request=request)
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, text="fresh", headers={"ETag": '"v1"'})
+
+        async def crawl():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                fetcher = ConditionalFetcher(client, {})
+                fetcher.cache = {"https://moodle.test/down": {"etag": None, "last_modified": None, "result": "cached"}}
+                results = await asyncio.gather(*(fetcher.fetch(f"https://moodle.test/{i}", str.upper)
+                                                 for i in ("up", "down", "slow")))
+                return list(results) + [await fetcher.fetch("https://moodle.test/up", str.lower), fetcher.stats["error"]]
+        cases = run(crawl())
+        assertions = ("FRESH", "cached", None, "FRESH", 2)
+        messages = ("Should parse new pages", "Should fall back to the last result when a page is unreachable",
+                    "Should return None for a failing page that was never crawled", "Should reuse the result on 304",
+                    "Should count the failed requests")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_incremental_sync(self):
+        store = Store(":memory:")
+        empty_mark = store.high_water_mark()
+        stored = [{"id": i, "timecreated": i * 10, "subject": "COMP210: Quiz", "fullmessage": f"COMP210: Quiz{MESSAGE_SEPARATOR}v1"}
+                  for i in (2, 1)]
+        store.upsert_notifications(stored)
+        mark = store.high_water_mark()
+        page = [{"id": i, "timecreated": i * 10, "subject": "COMP210: Quiz", "fullmessage": f"COMP210: Quiz{MESSAGE_SEPARATOR}v2"}
+                for i in (4, 3)] + [stored[0]]
+        new = [i for i in page if is_unseen(i, mark)]
+        cases = [empty_mark, high_water_mark(()), mark, [i["id"] for i in new], store.upsert_notifications(page),
+                 store.upsert_notifications([stored[1] | {"fullmessage": f"COMP210: Quiz{MESSAGE_SEPARATOR}v2"}])]
+        cases += [[(i["id"], i["fullmessage"][-2:]) for i in store.notifications()], store.high_water_mark()]
+        assertions = ({"id": 0, "timecreated": 0}, {"id": 0, "timecreated": 0}, {"id": 2, "timecreated": 20}, [4, 3], 2, 1,
+                      [(4, "v2"), (3, "v2"), (2, "v1"), (1, "v2")], {"id": 4, "timecreated": 40})
+        messages = ("Should start from nothing with an empty store", "Should start from nothing without notifications",
+                    "Should know the newest stored notification", "Should stop at the first stored notification",
+                    "Should not rewrite unchanged notifications", "Should replace edited notifications",
+                    "Should keep the old history without duplicates", "Should move the mark forward")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_search(self):
+        store = Store(":memory:")
+
+        def notification(i: int, message: str):
+            return {"id": i, "timecreated": i, "subject": "COMP210: Exam",
+                    "fullmessage": f"COMP210: Exam{MESSAGE_SEPARATOR}{message}{MESSAGE_SEPARATOR}Sent from moodle"}
+
+        def search(query: str):
+            match = fts_query(query)
+            return [i["id"] for i in store.search(match)] if match else []
+        store.upsert_notifications([notification(i, message) for i, message in enumerate((
+            "The quiz is postponed to next week", "Final exam grades are out", "Exams will be held next Monday, not next week"), start=1)])
+        cases = [search("next week"), search('"next week"'), search("exam"), search("EXAM grades"), search('"week next"'),
+                 search(""), search("moodle")]
+        store.upsert_notifications([notification(2, "Final grades are out")])
+        cases.append(search("exam"))
+        assertions = ([3, 1], [3, 1], [3, 2], [2], [], [], [], [3])
+        messages = ("Should AND bare terms newest first", "Should match phrases", "Should match longer words",
+                    "Should ignore case", "Should respect the phrase order", "Should handle empty queries",
+                    "Should only index the message", "Should follow edits")
+        begin_test(self, cases, assertions, messages=messages)
+        self.assertEqual(highlight('grades "final exam"', "Final exam grades are out"),
+                         "[Final exam] [grades] are out")
+
+    def test_relative_range(self):
+        anchor = datetime(2022, 3, 25)
+        cases = (relative_range("", anchor), relative_range("3 days", anchor), relative_range("next month", anchor),
+                 relative_range("past 2 weeks", anchor), relative_range("1 day ago", anchor), relative_range("tomorrow", anchor),
+                 relative_range("lab", anchor), relative_range("9999 years", anchor), relative_range("past 99999999999 days", anchor))
+        assertions = ((False, datetime(2022, 4, 1)), (False, datetime(2022, 3, 28)),
+                      (False, datetime(2022, 4, 25)), (True, datetime(2022, 3, 11)), (True, datetime(2022, 3, 24)),
+                      (False, datetime(2022, 3, 26)), None, None, None)
+        messages = ("Should default to a week", "Should count days",
+                    "Should handle modifiers", "Should go backwards", "Should go backwards with ago",
+                    "Should handle words", "Should reject anything else", "Should reject years past the calendar",
+                    "Should reject days past the calendar")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_announcement_table(self):
+        store = Store(":memory:")
+        store.upsert_courses([{"shortname": "COMP210", "fullname": "Data Structures - COMP210", "viewurl": "x"},
+                              {"shortname": "MATH101", "fullname": "Calculus - MATH101", "viewurl": "y"}])
+        store.upsert_notifications([{"id": i, "timecreated": created, "subject": title, "fullmessage": f"{title}{MESSAGE_SEPARATOR}text"}
+                                    for i, (title, created) in enumerate((("COMP210: Quiz 1", 10), ("COMP210: Lab 2", 30),
+                                                                          ("MATH101: Project", 20), ("MATH101: Quiz and lab", 20)))])
+        announcements = [announcement_from_row(i) for i in store.created_since(0)]
+        announcements[-1].deadline = to_natural_str(datetime(2022, 3, 25))
+        store.annotate(announcements)
+        table = AnnouncementTable(store.columns())
+
+        def titles(**conditions):
+            return [i["subject"] for i in store.by_ids(table.select(table.mask(**conditions)))]
+        cases = [titles(), titles(codes=["COMP210"]), titles(kinds=["lab"]), titles(kinds=["exam", "project"]),
+                 titles(codes=["MATH101"], kinds=["lab"]), titles(created_after=20),
+                 titles(deadline_between=(date(2022, 3, 25), date(2022, 3, 25))), titles(codes=["PHYS101"]), titles(kinds=["session"])]
+        cases += [[[i.title for i in TelegramInterface(store, columnar=columnar).filter_by_type_worker(query)] for query in ("lab", "comp210")]
+                  for columnar in (False, True)]
+        assertions = (["COMP210: Lab 2", "MATH101: Quiz and lab", "MATH101: Project", "COMP210: Quiz 1"],
+                      ["COMP210: Lab 2", "COMP210: Quiz 1"], ["COMP210: Lab 2", "MATH101: Quiz and lab"],
+                      ["MATH101: Quiz and lab", "MATH101: Project", "COMP210: Quiz 1"], ["MATH101: Quiz and lab"],
+                      ["COMP210: Lab 2"], ["COMP210: Quiz 1"], [], [],
+                      [["COMP210: Lab 2", "MATH101: Quiz and lab"], ["COMP210: Lab 2", "COMP210: Quiz 1"]],
+                      [["COMP210: Lab 2", "MATH101: Quiz and lab"], ["COMP210: Lab 2", "COMP210: Quiz 1"]])
+        messages = ("Should order newest first then by id", "Should filter by course", "Should filter by type",
+                    "Should match any of the types", "Should combine conditions", "Should exclude the creation time",
+                    "Should include both ends of the deadline range", "Should match nothing for unknown courses",
+                    "Should match nothing for unknown types", "Should filter through the store's queries",
+                    "Should filter through the table the same way")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_fuzzy_index(self):
+        commands = FuzzyIndex((i, i) for i in ("help", "whatis", "filter_by_type", "filter", "remind", "meeting_links"))
+        courses = FuzzyIndex((("COMP210", 0), ("Data Structures ", 0), ("COMP208", 1), ("Programming I ", 1), ("MATH281", 2)))
+        cases = tuple(None if i is None else (i[0], round(i[1], 2)) for i in (
+            commands.best("hlp"), commands.best("fitler"), commands.best("meetinglinks"), commands.best("xyz"),
+            courses.best("comp 210", 0.75, True), courses.best("datastructure", 0.75, True),
+            courses.best("programing", 0.75, True), courses.best("comp2", 0.75, True), courses.best("algebra", 0.75, True),
+            courses.best("28", 0.75, True), courses.best("uc", 0.75, True)))
+        assertions = (("help", 0.86), ("filter", 0.83), ("meeting_links", 1.0), None, (0, 1.0), (0, 0.96), (1, 0.91),
+                      (0, 0.83), None, (2, 0.44), (0, 0.25))
+        messages = ("Should correct typos", "Should pick the best match, not the first", "Should ignore separators",
+                    "Should reject unrelated words", "Should ignore spaces", "Should prefer containing keys",
+                    "Should match course names", "Should break ties by insertion order", "Should reject unrelated courses",
+                    "Should find short queries inside keys", "Should find short queries inside names")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_render_cache(self):
+        announcement = Announcement("COMP210: Quiz", f"COMP210: Quiz{MESSAGE_SEPARATOR}on Monday", 0)
+        announcement.deadline = to_natural_str(datetime.now() + timedelta(days=3))
+        first = notification_message_builder(announcement)
+        highlighted = notification_message_builder(announcement, custom_message="on [Monday]")
+        cases = [notification_message_builder(announcement) is first, "[Monday]" in highlighted]
+        announcement.deadline = to_natural_str(datetime.now() + timedelta(days=5))
+        cases.append("4days left" in notification_message_builder(announcement))
+        announcement.rendered = (announcement.rendered[0], "stale")
+        cases.append(notification_message_builder(announcement))
+        assertions = (True, True, True, "stale")
+        messages = ("Should reuse the rendered text", "Should not cache highlighted text",
+                    "Should render again when the deadline changes", "Should use the cache for the same day")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_classifier(self):
+        cases = tuple(classify(title, message) for title, message in (
+            ("COMP210: Quiz postponed", "see https://zoom.us/j/1 and https://moodle.bau.edu.lb/x"),
+            ("COMP210: Lab exams", ""),
+            ("MATH281: incomplete exam new date", "no links")))
+        self.assertEqual([(i.important, i.types, i.postponed, i.links) for i in cases],
+                         [(True, {"exam"}, True, ("https://zoom.us/j/1",)),
+                          (True, {"lab", "exam"}, False, None),
+                          (True, {"exam"}, True, None)])
+
+    def test_store(self):
+        store = Store(":memory:")
+        store.upsert_courses([{"shortname": "COMP210", "fullname": "Data Structures - COMP210", "viewurl": "x"},
+                              {"shortname": "MATH281", "fullname": "Linear Algebra - MATH281", "viewurl": "y"}])
+        notifications = [{"id": i, "timecreated": i * 10, "subject": subject, "fullmessage": f"{subject}{MESSAGE_SEPARATOR}{message}"}
+                         for i, (subject, message) in enumerate((("COMP210: Quiz", "on Monday"), ("MATH281: Lab", "https://zoom.us/j/1"),
+                                                                 ("COMP210: Material", "chapter 3")), start=1)]
+        store.upsert_notifications(notifications)
+        store.upsert_notifications(notifications[:1])
+        announcements = [announcement_from_row(i) for i in store.created_since(0)]
+        announcements[-1].deadline = to_natural_str(datetime(2022, 3, 21))
+        store.annotate(announcements)
+        cases = ([i["id"] for i in store.by_subject_codes(["COMP210"])], [i["id"] for i in store.by_type("lab")],
+                 [i["id"] for i in store.deadlines_between(datetime(2022, 3, 20), datetime(2022, 3, 27))],
+                 store.high_water_mark(), store.mappings(), [i.subject for i in announcements])
+        assertions = ([3, 1], [2], [1], {"id": 3, "timecreated": 30}, {"COMP210": "Data Structures ", "MATH281": "Linear Algebra "},
+                      ["Data Structures ", "Linear Algebra ", "Data Structures "])
+        messages = ("Should use the subject code index newest first", "Should use the types of the announcements",
+                    "Should find deadlines in the range", "Should know the newest notification",
+                    "Should derive the course names", "Should join the course names")
+        begin_test(self, cases, assertions, messages=messages)
+        store.add_links([("Linear Algebra ", "https://zoom.us/j/1")] * 2)
+        self.assertEqual(store.links(), {"Linear Algebra ": ["https://zoom.us/j/1"]}, "Should store a link once")
+
+    def test_links_journal(self):
+        store = Store(":memory:")
+        store.upsert_courses([{"shortname": "COMP210", "fullname": "Data Structures - COMP210", "viewurl": "x"}])
+
+        def notification(i: int, message: str):
+            return {"id": i, "timecreated": i, "subject": "COMP210: Lab", "fullmessage": f"COMP210: Lab{MESSAGE_SEPARATOR}{message}"}
+        store.upsert_notifications([notification(1, "https://zoom.us/j/1"), notification(2, "https://zoom.us/j/1")])
+        cases = [store.scan_links(), store.scan_links()]
+        store.upsert_notifications([notification(3, "https://teams.microsoft.com/l/2"), notification(1, "https://zoom.us/j/3")])
+        cases += [store.scan_links(), store.links()]
+        store.upsert_courses([])
+        cases.append(len(store.links()))
+        store.upsert_courses([{"shortname": "MATH281", "fullname": "Linear Algebra - MATH281", "viewurl": "y"}])
+        cases.append(store.links())
+        assertions = (2, 0, 2, {"Data Structures ": ["https://teams.microsoft.com/l/2", "https://zoom.us/j/1", "https://zoom.us/j/3"]}, 1, {})
+        messages = ("Should scan every new announcement", "Should not scan twice", "Should only scan new and edited announcements",
+                    "Should keep old links", "Should ignore an empty enrolment", "Should drop the links of courses that are gone")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_reminders(self):
+        store = Store(":memory:")
+        store.upsert_notifications([{"id": 1, "timecreated": 1, "subject": "COMP210: Quiz",
+                                     "fullmessage": f"COMP210: Quiz{MESSAGE_SEPARATOR}on Monday"}])
+        deadline = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=10)
+        announcement = announcement_from_row(store.created_since(0)[0])
+        sent = []
+        scheduler = ReminderScheduler(lambda announcement, days_before: sent.append(days_before), store)
+
+        def reschedule(new_deadline: datetime):
+            announcement.deadline = to_natural_str(new_deadline)
+            store.annotate([announcement])
+            scheduler.update()
+        reschedule(deadline)
+        cases = [scheduler.fire_due(deadline - timedelta(days=8)), scheduler.fire_due(deadline - timedelta(days=7, hours=-9))]
+        reschedule(deadline + timedelta(days=1))
+        cases += [len(scheduler.heap), scheduler.fire_due(deadline + timedelta(hours=9)), sent]
+        restarted = ReminderScheduler(sent.append, store)
+        restarted.push(store.take_reminders(pending=True))
+        cases += [restarted.heap, ReminderScheduler(sent.append).fire_due(deadline)]
+        assertions = (0, 1, 3, 1, [7, 1], [], 0)
+        messages = ("Should not fire early", "Should fire a week ahead", "Should queue the moved reminders",
+                    "Should only send the day-before reminder when the week one is overdue as well",
+                    "Should drop stale entries", "Should not send anything twice after a restart",
+                    "Should not fire before it is started")
+        begin_test(self, cases, assertions, messages=messages)
+
+    def test_message_queue(self):
+        clock, sent = [0.0], []
+
+        class RateLimited(Exception):
+            error_code, result_json = 429, {"parameters": {"retry_after": 5}}
+
+        def send(chat, text):
+            if text == "limited" and not any(i == (chat, text) for i in sent):
+                sent.append((chat, text))
+                raise RateLimited()
+            sent.append((chat, text))
+        queue = MessageQueue(send, chat_rate=1, chat_burst=1, global_rate=10, global_burst=3, limit=10, clock=lambda: clock[0])
+        for chat, text in (("a", "1"), ("a", "2"), ("a", "0123456789"), ("a", "3"), ("b", "4"), ("b", "5"), ("c", "6"), ("b", "limited")):
+            queue.put(chat, text)
+        cases = [queue.flush(), list(sent)]
+        clock[0] = 1.0
+        cases += [queue.flush(), sent[3:]]
+        clock[0] = 2.0
+        cases.append(queue.flush())
+        clock[0] = 6.0
+        cases += [queue.flush(), sent[5:], queue.pending]
+        assertions = (0.1, [("a", "1\n2"), ("b", "4\n5"), ("c", "6")], 1.0, [("a", "0123456789"), ("b", "limited")], 4.0,
+                      None, [("a", "3"), ("b", "limited")], 0)
+        messages = ("Should wait for the global limit", "Should join small messages and serve every chat",
+                    "Should wait for the chat limit", "Should respect the size limit", "Should wait for the retry_after",
+                    "Should be done", "Should keep the order within a chat and retry", "Should send everything")
+        begin_test(self, cases, assertions, messages=messages)
+        document, sent = io.BytesIO(b"links"), []
+        queue = MessageQueue(lambda chat, message: sent.append(message), chat_burst=10, clock=lambda: 0.0)
+        for i in ("1", document, "2", "3"):
+            queue.put("a", i)
+        queue.flush()
+        self.assertEqual(sent, ["1", document, "2\n3"], "Should send files on their own, in order")
+
+    def test_chat_sessions(self):
+        clock = [0.0]
+        sessions = ChatSessions(ttl=10, clock=lambda: clock[0])
+        sessions.get("group a").interactive = True
+        clock[0] = 6
+        sessions.get("group b").last_argument = "comp210"
+        cases = [sessions.get("group a").interactive, sessions.get("group b").interactive]
+        clock[0] = 12
+        cases += [sessions.get("group b").last_argument, len(sessions)]
+        clock[0] = 30
+        cases += [sessions.get("group a").interactive, len(sessions)]
+        assertions = (True, False, "comp210", 2, False, 1)
+        messages = ("Should keep the state of a chat", "Should not share state between chats", "Should refresh on use",
+                    "Should keep chats used within the ttl", "Should forget expired chats", "Should evict expired chats")
+        begin_test(self, cases, assertions, messages=messages)
 
 
 if __name__ == "__main__":
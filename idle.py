@@ -1,20 +1,31 @@
 """
 Bot listens to commands here.
 """
-import os
-from typing import Callable, Iterable, Optional, TypeVar
+import asyncio
+from contextvars import ContextVar
+import io
+import logging
+import threading
+from typing import Callable, Optional, TypeVar
 import telebot
-from concurrent.futures import ThreadPoolExecutor
+from telebot.async_telebot import AsyncTeleBot
+from concurrent.futures import Future
+import endpoint
 from functions import TelegramInterface, notification_message_builder
-from utilities.common import autocorrect, WebsiteMeta, IO_DATA_DIR, bool_return, mapping_init
-
-api_key, chat_id = WebsiteMeta.api_key, WebsiteMeta.public_context
-# set the bot to testing mode if the words true, True, T, yes, y, or yes, set to normal mode otherwise
-testing = dict.fromkeys(("true", "True", "T", "yes", "y", "Yes"), True).get(
-    IO_DATA_DIR("settings.cfg").split("=")[1], False)
-chat_id = WebsiteMeta.testing_chat_context if testing else WebsiteMeta.public_context
-bot = telebot.TeleBot(api_key)
-mapping_init()
+from utilities.chat_sessions import ChatSessions
+from utilities.common import website_meta, bot_settings, bool_return, json, links_and_meetings_wrapper, setting_enabled, setup_logging
+from utilities.input_filters import annotate_changes
+from utilities.message_queue import Message, MessageQueue
+from utilities.moodle_session import MoodleSession
+from utilities.reminders import ReminderScheduler
+from utilities.search_index import FuzzyIndex
+from utilities.semester_utils import semester_info
+from utilities.store import get_store
+
+# both set by configure, on startup rather than on import
+bot: AsyncTeleBot
+# the chat in creds.txt, reminders and other messages sent outside of a command go there
+chat_id: str
 intro = """
 Hello ! To start using me, simply write a command in plain text and I will do my best to correct it (if you misspell a word).
 
@@ -32,26 +43,139 @@ T = TypeVar("T")
 def auto_split(msg: str): return telebot.util.smart_split(msg, 3000)
 
 
-try:
-    interface = TelegramInterface()
-except (KeyError, FileNotFoundError):
-    bot.send_message(
-        chat_id, "The moodle webservice is down, I will not respond until a minute or two.")
+interface: Optional[TelegramInterface] = None
+interface_lock = threading.Lock()
 
 
-def autoremind():
-    result = interface.autoremind_worker()
-    send_multithreaded(result)
-    return result
+def get_interface() -> TelegramInterface:
+    """
+    The interface every command works with, built on first use (or by warm_up) rather than on import.
+    """
+    global interface
+    if interface is None:
+        with interface_lock:
+            if interface is None:
+                interface = make_interface()
+    return interface
 
 
-def send_message(text: str):
-    bot.send_message(chat_id, text)
+def make_interface() -> TelegramInterface:
+    return TelegramInterface(columnar=setting_enabled("columnar_filters"))
+
+
+def parsing_processes() -> int:
+    # the processes setting, deadlines are parsed by that many processes (in a thread when 0, the default)
+    return int(bot_settings().get("processes", "0"))
+
+
+def warm_up():
+    """
+    Loads the calendar, parses what the last refresh left unparsed and builds the interface ahead of the first command,
+    meant to run in the background while the bot is already polling.
+    The reminders are started whatever happens, they only need the store.
+    """
+    try:
+        semester_info()
+        asyncio.run(annotate_changes(get_store(), parsing_processes()))
+        get_interface()
+    except (KeyError, FileNotFoundError):
+        send_message(
+            "The moodle webservice is down, I will not respond until a minute or two.")
+    except Exception:
+        logging.exception("Warming up failed")
+    finally:
+        reminders.start()
+
+
+# refreshes run here so that the bot's loop keeps answering commands in the meantime, started with the bot
+refresh_loop = asyncio.new_event_loop()
+refresh_lock = threading.Lock()
+current_refresh: Optional[Future] = None
+# one client and login shared by every refresh, created on the refresh loop
+moodle_session: Optional[MoodleSession] = None
+
+
+async def _refresh_interface():
+    global interface, moodle_session
+    if moodle_session is None:
+        moodle_session = MoodleSession()
+    await endpoint.main(moodle_session)
+    await annotate_changes(get_store(), parsing_processes())
+    new_interface = await refresh_loop.run_in_executor(None, make_interface)
+    # commands pick up the new data as soon as the name is rebound
+    interface = new_interface
+    reminders.update()
+
+
+def start_refresh_loop():
+    threading.Thread(target=refresh_loop.run_forever, daemon=True).start()
+
+
+def refresh_interface(on_done: Optional[Callable[[Optional[BaseException]], None]] = None) -> bool:
+    """
+    Starts a refresh in the background, returns False if one is already running.
+    """
+    global current_refresh
+    with refresh_lock:
+        if current_refresh and not current_refresh.done():
+            return False
+        current_refresh = asyncio.run_coroutine_threadsafe(
+            _refresh_interface(), refresh_loop)
+    if on_done:
+        current_refresh.add_done_callback(
+            lambda future: on_done(future.exception()))
+    return True
+
+
+def autoremind() -> str:
+    return "\n".join(map(notification_message_builder, get_interface().autoremind_worker()))
+
+
+# the loop the bot polls on, set by main
+bot_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def call_bot(coroutine):
+    """
+    Runs a bot api call on the bot's loop from a worker thread and waits for it.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, bot_loop).result()
+
+
+def send_to_telegram(chat: int | str, message: Message):
+    if isinstance(message, str):
+        return call_bot(bot.send_message(chat, message))
+    # a retry after a 429 sends the file again from the start
+    message.seek(0)
+    return call_bot(bot.send_document(chat, document=message))
+
+
+# every message (and file) goes out through here, in order and within telegram's rate limits, started with the bot
+outbox = MessageQueue(send_to_telegram)
+
+
+# the chat the command being handled came from, replies go there (chat_id outside of a command)
+current_chat: ContextVar[int | str] = ContextVar("current_chat")
+
+
+def send_message(text: str, chat: Optional[int | str] = None):
+    chat = current_chat.get(chat_id) if chat is None else chat
+    for chunk in auto_split(text):
+        outbox.put(chat, chunk)
+
+
+def send_reminder(announcement, days_before: int):
+    send_message(
+        f"Reminder, {'1 day' if days_before == 1 else f'{days_before} days'} left :{notification_message_builder(announcement)}")
+
+
+# sends the automatic reminders, started by warm_up once the announcements are annotated
+reminders = ReminderScheduler(send_reminder)
 
 
 def wrap_result(res: Optional[str], fail_message: str):
     # handle both Announcement objects and strings
-    send_multithreaded(auto_split(res)) if res else send_message(fail_message)
+    send_message(res) if res else send_message(fail_message)
 
 
 def map_aliases(name: str) -> dict[str, str]:
@@ -70,26 +194,20 @@ def map_aliases(name: str) -> dict[str, str]:
     return {alias: name for alias in aliases}
 
 
-def send_multithreaded(T: Iterable[str], *args, **kwargs):
-    with ThreadPoolExecutor() as executor:
-        for item in T:
-            executor.submit(send_message, item, *args, **kwargs)
-
-
 class BotCommands:
     bot_commands: list[str]
     aliases: dict[str, str]
+    # aliases -> command names, for correcting misspelled commands
+    command_index: FuzzyIndex[str]
 
     def __init__(self) -> None:
         BotCommands.bot_commands = [func for func in dir(BotCommands) if callable(
             getattr(BotCommands, func)) and not func.startswith("__")]
-        self.last_command: Callable[[str], None]
-        self.last_argument = ""
-        self.interactive = False
         BotCommands.aliases = {}
         aliases_dict = [map_aliases(name) for name in BotCommands.bot_commands]
         for alias in aliases_dict:
             BotCommands.aliases |= alias
+        BotCommands.command_index = FuzzyIndex(BotCommands.aliases.items())
 
     @staticmethod
     def whatis(message):
@@ -97,7 +215,7 @@ class BotCommands:
         Tells you what a subject code is if it is recognized.
         For example, COMP210 is Programming II
         """
-        subject = interface.name_wrapper(message)
+        subject = get_interface().name_wrapper(message)
         send_message(
             f"{message} is {subject}" if subject else "Subject not recognized")
 
@@ -106,11 +224,12 @@ class BotCommands:
         """
         A convenience function to send the zoom/teams meeting links of every subject in a text file.
         """
-        interface.update_links_and_meetings()
-        string_to_be_processed = IO_DATA_DIR("links_and_meetings.json")
-        IO_DATA_DIR("links_and_meetings.txt", "w", string_to_be_processed)
-        bot.send_document(chat_id, document=open(
-            "./bot_data_stuff/links_and_meetings.txt", "rb"))
+        get_interface().update_links_and_meetings()
+        # built in memory, commands from several chats never share a file
+        document = io.BytesIO(json.dumps(
+            links_and_meetings_wrapper(), indent=4).encode())
+        document.name = "links_and_meetings.txt"
+        outbox.put(current_chat.get(chat_id), document)
 
     @staticmethod
     def help(message):
@@ -148,7 +267,7 @@ class BotCommands:
         If you want to filter notifications by type, call the search function with an argument.
         """
         send_message(
-            "\n".join(map(notification_message_builder, interface.notifications)))
+            "\n".join(map(notification_message_builder, get_interface().important_worker())))
 
     @staticmethod
     def commands(message):
@@ -173,13 +292,28 @@ class BotCommands:
         stuff = autoremind()
         wrap_result(stuff, "No urgent notifications found")
 
+    @staticmethod
+    def agenda(message: str):
+        """
+        Sends the deadlines from today up to the end of a range, for example agenda 3 days, agenda next month or
+        agenda tomorrow (a week by default).
+        Backwards ranges (agenda past 2 weeks, agenda 3 days ago) send the notifications posted since then instead.
+        """
+        res = get_interface().agenda_worker(message)
+        if res is None:
+            send_message(
+                f"{message} is not a range, try something like 3 days, next month or past 2 weeks")
+        else:
+            wrap_result("\n".join(map(notification_message_builder, res)),
+                        "Nothing in this range")
+
     @staticmethod
     def search(message: str):
         """
         Searches every notification and returns a "view" if more than one match is found.
         It can also search by notification type (lab, quiz, test, etc...) , see the help text or github page for more information.
         """
-        potential_messages = interface.search_notifications(message)
+        potential_messages = get_interface().search_notifications(message)
         wrap_result(potential_messages,
                     "No notifications matching this query were found.")
 
@@ -198,7 +332,7 @@ class BotCommands:
         notifications from a subject's lab (note that lab exams can be found from both filter exam and filter lab so certain types may overlap)
         """
 
-        res = bool_return(interface.filter_by_type_worker(query), "")
+        res = bool_return(get_interface().filter_by_type_worker(query), "")
         final_res = "\n".join(map(notification_message_builder, res))
         wrap_result(
             final_res, "No notifications matching this filter were found")
@@ -208,18 +342,34 @@ class BotCommands:
         """
         Refreshes notifications automatically
         """
-        send_message("Updating notifications")
-        os.chdir("/".join(__file__.split("/")[:-1]))
-        os.system("python3 endpoint.py")
-        send_message("Done updating notifications")
+        # the refresh finishes on another thread, outside of this command's context
+        chat = current_chat.get()
+
+        def _done(error: Optional[BaseException]):
+            send_message(
+                f"Failed to update notifications : {error}" if error else "Done updating notifications", chat)
+        if refresh_interface(_done):
+            send_message("Updating notifications")
+        else:
+            send_message("Notifications are already being updated")
 
 
 c = BotCommands()
+# one entry per chat, the store and the interface are shared by all of them
+sessions = ChatSessions()
 
 
-@bot.message_handler(content_types=["text"])
-def language_interpreter(message: telebot.types.Message):
+async def run_command(command: Callable[[str], None], argument: str):
+    # commands block (data work, waiting on the store), every one gets a worker thread so the others keep going.
+    # to_thread carries current_chat over to the thread
+    await asyncio.to_thread(command, argument)
+
+
+async def language_interpreter(message: telebot.types.Message):
     def get_fn(f: str): return getattr(c, c.aliases[f])
+    # every update is handled in a task of its own, setting it here does not leak into other chats
+    current_chat.set(message.chat.id)
+    state = sessions.get(message.chat.id)
     thing = message.text.lower()
     function, *_ = thing.split(" ")
     argument = " ".join(_)
@@ -229,23 +379,49 @@ def language_interpreter(message: telebot.types.Message):
     if any(i == thing for i in phrases) or "use this" in thing:
         send_message(intro)
     elif in_aliases():
-        c.last_command = get_fn(function)
-        c.last_command(argument)
-    elif function in responses and c.interactive:
+        state.last_command = get_fn(function)
+        await run_command(state.last_command, argument)
+    elif function in responses and state.interactive and state.last_command:
+        state.interactive = False
         if function in responses[2:]:
             send_message("Abort.")
         else:
-            c.last_command(c.last_argument)
+            await run_command(state.last_command, state.last_argument)
     elif not in_aliases():
-        corrected: str = autocorrect(c.aliases, function)
-        if corrected:
-            c.last_command = get_fn(corrected)
-            c.last_argument = argument
+        match = c.command_index.best(function, ratio=0.7)
+        if match:
+            corrected, _ = match
+            state.last_command = get_fn(corrected)
+            state.last_argument = argument
             send_message(
                 f"{message.text} not recognized, did you mean {corrected} ? Type [y]es to execute or [n]o to abort")
-            c.interactive = True
+            state.interactive = True
+
+
+def configure():
+    """
+    Reads the credentials and settings.cfg and creates the bot, call it before main.
+    """
+    global bot, chat_id
+    meta = website_meta()
+    chat_id = meta.testing_chat_context if setting_enabled("testing") else meta.public_context
+    bot = AsyncTeleBot(meta.api_key)
+    bot.register_message_handler(language_interpreter, content_types=["text"])
+
+
+async def main():
+    global bot_loop
+    bot_loop = asyncio.get_running_loop()
+    outbox.start()
+    start_refresh_loop()
+    bot_loop.run_in_executor(None, warm_up)
+    try:
+        await bot.infinity_polling()
+    finally:
+        await bot.close_session()
 
 
 if __name__ == '__main__':
-    # autoremind()
-    bot.infinity_polling()
+    setup_logging()
+    configure()
+    asyncio.run(main())
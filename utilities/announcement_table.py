@@ -0,0 +1,70 @@
+"""
+The announcements' filterable columns as numpy arrays, so filtering years of history is a few vectorized comparisons.
+"""
+from __future__ import annotations
+from datetime import date
+import sqlite3
+from typing import Iterable, Optional
+import numpy as np
+
+
+class AnnouncementTable:
+    """
+    One row per announcement, in the order of the rows it is built from (the store's columns, newest first).
+    Subject codes are interned to small ints and every type gets a bit, a filter is then a boolean mask over the
+    columns and selecting gives the matching ids in row order, the announcements themselves stay in the store.
+    """
+
+    def __init__(self, rows: Iterable[sqlite3.Row] = ()) -> None:
+        rows = list(rows)
+        self.code_ids: dict[str, int] = {}
+        self.type_bits: dict[str, int] = {}
+        count = len(rows)
+        self.ids = np.fromiter((i["id"] for i in rows), np.int64, count)
+        self.time_created = np.fromiter(
+            (i["timecreated"] for i in rows), np.int64, count)
+        # iso dates, NaT (which compares as False) for announcements without a deadline
+        self.deadline = np.array([i["deadline"] or "NaT" for i in rows], "datetime64[D]")
+        self.subject_code = np.fromiter((self.code_ids.setdefault(i["subject_code"], len(self.code_ids))
+                                         for i in rows), np.int32, count)
+        self.types = np.fromiter((self.type_mask(i["types"].split(",") if i["types"] else (), add=True)
+                                  for i in rows), np.uint64, count)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def type_mask(self, kinds: Iterable[str], add: bool = False) -> int:
+        """
+        The bits of kinds, types never seen before get a bit only if add (otherwise they match nothing).
+        """
+        mask = 0
+        for kind in kinds:
+            if add and kind not in self.type_bits:
+                self.type_bits[kind] = 1 << len(self.type_bits)
+            mask |= self.type_bits.get(kind, 0)
+        return mask
+
+    def mask(self, codes: Optional[Iterable[str]] = None, kinds: Optional[Iterable[str]] = None,
+             created_after: Optional[int] = None, deadline_between: Optional[tuple[date, date]] = None) -> np.ndarray:
+        """
+        Rows matching every given condition: one of the subject codes, one of the types, created after a timestamp,
+        deadline in an inclusive range of dates.
+        """
+        result = np.ones(len(self), bool)
+        if codes is not None:
+            ids = [self.code_ids[i] for i in codes if i in self.code_ids]
+            result &= np.isin(self.subject_code, ids)
+        if kinds is not None:
+            result &= (self.types & np.uint64(self.type_mask(kinds))) != 0
+        if created_after is not None:
+            result &= self.time_created > created_after
+        if deadline_between is not None:
+            low, high = (np.datetime64(i, "D") for i in deadline_between)
+            result &= (self.deadline >= low) & (self.deadline <= high)
+        return result
+
+    def select(self, mask: np.ndarray) -> list[int]:
+        """
+        Ids of the matching rows, the store's by_ids reads them.
+        """
+        return self.ids[mask].tolist()
@@ -1,12 +1,18 @@
 from dataclasses import dataclass
-import logging
 from datetime import datetime
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import hashlib
+import itertools as it
+import json
 import re
-from typing import AsyncGenerator, List, Optional, Tuple
-import httpx
+from typing import AsyncGenerator, List, Mapping, Optional, Sequence
 import datefinder
-from utilities.common import Announcement, Assignment, WebsiteMeta, add_cookies_to_header, clean_iter, coerce_to_none, courses_wrapper, css_selector, flattening_iterator, get_group, my_format, null_safe_index, safe_next, soup_bowl, url_encode, to_natural_str
+from utilities.common import Announcement, Assignment, bool_return, courses_wrapper, mappings_wrapper, flattening_iterator, get_group, my_format, null_safe_index, safe_next, soup_bowl, to_natural_str
+from utilities.crawler import ConditionalFetcher
+from utilities.moodle_session import PAGE_HEADERS, MoodleSession
+from utilities import semester_utils
 from utilities.semester_utils import find_week_of_datetime
 from utilities.time_parsing_lib import RelativeDate
 
@@ -48,95 +54,129 @@ async def async_filter(async_pred, iterable) -> AsyncGenerator:
             yield item
 
 
-async def get_data(dicts: list[dict]):
+DELETE_TZINFO_REGEX = re.compile(r"\d+:\d+", re.MULTILINE)
+
+
+def find_deadline(announcement: Announcement) -> Optional[datetime]:
+    """
+    The expensive part of get_data: datefinder, relative dates and the semester week lookup.
+    Only exams and projects have deadlines.
+    """
+    if not ("exam" in announcement.subject_type or "project" in announcement.subject_type):
+        return None
+    finder = datefinder.DateFinder(
+        base_date=announcement.date_created, first="day")
+    explicit_date: Optional[datetime] = null_safe_index(safe_next(
+        filter(found_explicit_date, finder.find_dates(DELETE_TZINFO_REGEX.sub("", announcement.message), source=True))), 0)
+    if explicit_date:
+        # If one or more explicit date is found, bypass implicit date checking and get the minimum
+        # since the minumum date is usually always the first result, getting the minimum is not needed
+        return explicit_date
+    # if no explicit date is found, generate a relative date from the time created
+    make_relative_date = RelativeDate(
+        string=announcement.message, anchor=announcement.date_created)
+    _dt = safe_next(make_relative_date.generate_results())
+    if _dt:
+        return _dt
+    week_number = get_group(
+        re.search("week\s+\d+", announcement.message.lower(), re.MULTILINE))
+    if week_number:
+        return find_week_of_datetime(week=int(re.split("\s+", week_number)[1]))
+    return None
+
+
+def set_deadline(announcement: Announcement, deadline: Optional[datetime], now: Optional[datetime] = None):
+    now = bool_return(now, datetime.now())
+    announcement.deadline = to_natural_str(deadline) if deadline else None
+    announcement.time_delta = (deadline - now).days if deadline else None
+
+
+def parse_cache_key(obj: Mapping) -> str:
+    content = json.dumps([obj["subject"], obj["fullmessage"], obj["timecreated"]])
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def find_deadlines(announcements: List[Announcement]) -> List[Optional[datetime]]:
+    return [find_deadline(i) for i in announcements]
+
+
+def _share_semester_info(info: semester_utils.SemesterMetaInfo):
+    # a spawned worker starts from a fresh interpreter, it would download the calendar pdf again
+    setattr(semester_utils, "semester_info", lambda: info)
+
+
+async def parse_deadlines(announcements: List[Announcement], processes: Optional[int] = 0, chunk_size: int = 64) -> List[Optional[datetime]]:
+    """
+    Runs find_deadline outside of the event loop: in a thread when processes is 0, otherwise chunks of
+    announcements are spread over a process pool (None uses every core). Deadlines keep the input order.
+    The pool is opt-in, the bot uses it when the processes setting is set (worth it for a long history parsed at once).
+    Workers are spawned rather than forked (the bot's threads and locks are not copied) and get the calendar from here.
+    """
+    loop = asyncio.get_running_loop()
+    if not announcements:
+        return []
+    if processes == 0 or len(announcements) <= chunk_size:
+        return await loop.run_in_executor(None, find_deadlines, announcements)
+    chunks = [announcements[i:i + chunk_size]
+              for i in range(0, len(announcements), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_share_semester_info, initargs=(semester_utils.semester_info(),)) as executor:
+        results = await collect_tasks(collection=(loop.run_in_executor(executor, find_deadlines, chunk) for chunk in chunks))
+    return list(it.chain.from_iterable(results))
+
+
+async def get_data(dicts: Sequence[Mapping], use_cache: bool = True, processes: Optional[int] = 0, chunk_size: int = 64):
+    """
+    Builds announcements and their deadlines from the store's rows. A row whose parse_key still matches its content
+    keeps its stored deadline, so only new or edited announcements go through the date parsers
+    (the store's annotate saves the new deadlines and keys). See parse_deadlines for processes and chunk_size.
+    """
     objects = [i for i in dicts]
     keys = ("subject",
             "fullmessage", "timecreated")
 
+    try:
+        mappings = mappings_wrapper()
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        mappings = {}
+
     async def _make_announcement(obj):
         announcement = Announcement(
-            *[obj[key] for key in keys])
+            *[obj[key] for key in keys], id=obj.get("id"))
+        announcement.subject = mappings.get(announcement.subject_code)
         return announcement
 
     objects = await collect_tasks(_make_announcement, objects)
 
-    async def _time_delta_worker(announcement: Announcement):
-        explicit_date: Optional[datetime]
-        DELETE_TZINFO_REGEX = re.compile(r"\d+:\d+", re.MULTILINE)
-        finder = datefinder.DateFinder(
-            base_date=announcement.date_created, first="day")
-        explicit_date = null_safe_index(safe_next(
-            filter(found_explicit_date, finder.find_dates(DELETE_TZINFO_REGEX.sub("", announcement.message), source=True))), 0)
-        now = datetime.now()
-        def subtract_from_today(ref: datetime): return (ref - now).days
-        announcement.time_delta, announcement.deadline = None, None
-        if "exam" in announcement.subject_type or "project" in announcement.subject_type:
-            if explicit_date:
-                dt = subtract_from_today(explicit_date)
-                announcement.deadline = to_natural_str(explicit_date)
-                announcement.time_delta = dt
-                # If one or more explicit date is found, bypass implicit date checking and get the minimum
-                # since the minumum date is usually always the first result, getting the minimum is not needed
-            else:
-                # if no explicit date is found, generate a relative date from the time created and subtract it from now
-                make_relative_date = RelativeDate(
-                    string=announcement.message, anchor=announcement.date_created)
-                _dt = safe_next(make_relative_date.generate_results())
-                if _dt:
-                    _date = subtract_from_today(_dt)
-                    announcement.time_delta = _date
-                    announcement.deadline = to_natural_str(_dt)
-                else:
-                    week_number = get_group(
-                        re.search("week\s+\d+", announcement.message.lower(), re.MULTILINE))
-                    announcement.time_delta, announcement.deadline = (subtract_from_today((_week := find_week_of_datetime(
-                        week=int(re.split("\s+", week_number)[1])))), to_natural_str(_week)) if week_number else None, None
-    await collect_tasks(_time_delta_worker, objects)
+    now = datetime.now()
+    uncached: list[Announcement] = []
+    for announcement, obj in zip(objects, dicts):
+        announcement.parse_key = parse_cache_key(obj)
+        if use_cache and obj.get("parse_key") == announcement.parse_key:
+            cached = obj.get("deadline")
+            set_deadline(announcement, datetime.fromisoformat(
+                cached) if cached else None, now)
+        else:
+            uncached.append(announcement)
+    my_format(f"{len(uncached)}/{len(objects)}", "Announcements to parse")
+    deadlines = await parse_deadlines(uncached, processes, chunk_size)
+    for announcement, deadline in zip(uncached, deadlines):
+        set_deadline(announcement, deadline, now)
     return objects
 
 
 def authenticate(func):
     """
-Authenticates an http request to the moodle website before attempting to scrape data
-useful for making arbitrary requests to it.
-
-:returns: the session cookies and the session itself.
+Hands a logged in MoodleSession to a scraper, the caller's session is borrowed if one is passed
+(so a refresh logs in once for every fetcher), otherwise a new one is opened and closed around the call.
 """
 
-    async def wrapper_func():
-        async with httpx.AsyncClient(timeout=None, follow_redirects=True) as Client:
-            querystring = {
-                "service": "https://moodle.bau.edu.lb/login/index.php"}
-            LOGIN_URL = r"https://icas.bau.edu.lb:8443/cas/login?service=https%3A%2F%2Fmoodle.bau.edu.lb%2Flogin%2Findex.php"
-            login_headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.7113.93 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/jxl,image/webp,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.5",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Origin": "https://icas.bau.edu.lb:8443",
-                "DNT": "1",
-                "Connection": "keep-alive",
-                "Referer": r"https://icas.bau.edu.lb:8443/cas/login?service=https%3A%2F%2Fmoodle.bau.edu.lb%2Flogin%2Findex.php",
-                "Upgrade-Insecure-Requests": "1",
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "same-origin",
-                "Sec-Fetch-User": "?1",
-                "Sec-GPC": "1"}
-            page = await Client.get(url=LOGIN_URL)
-            execution = css_selector(
-                page.text, "[name=execution]", "value")
-            username, password = WebsiteMeta.username, WebsiteMeta.password
-            encoded = url_encode(
-                {"username": username, "password": password,
-                 "execution": fr"{execution}", "_eventId": "submit",
-                 "geolocation": ""})
-            await Client.post(LOGIN_URL, data=encoded,
-                              headers=login_headers, params=querystring)
-            cookies = Client.cookies
-            my_format(cookies, "Cookies in async api")
-            await func(cookies, Client)
+    async def wrapper_func(session: Optional[MoodleSession] = None):
+        if session:
+            await session.login()
+            return await func(session)
+        async with MoodleSession() as session:
+            return await func(session)
     return wrapper_func
 
 
@@ -149,79 +189,46 @@ async def prep_courses():
     return {i async for i in course_generator(courses)}
 
 
+ASSIGNMENT_SELECTOR = "li.modtype_assign a[href]"
+
+
+def parse_course_page(html: str) -> list[str]:
+    return list(dict.fromkeys(i["href"] for i in soup_bowl(html).select(ASSIGNMENT_SELECTOR)))
+
+
+def parse_assignment_page(html: str) -> dict[str, Optional[str]]:
+    """
+    selectors for each attribute:
+
+    reference_material_link : div > h2
+    deadline : the "Due date" row of div.submissionstatustable
+    submission_link : div[id='intro'] > div > p >a  (If any)
+    """
+    bowl = soup_bowl(html)
+    reference_material, submission_link = tuple(map(
+        bowl.select_one, ("div div > h2", "div[id='intro'] > div > p > a")))
+    deadline = next((row.select_one("td").get_text(strip=True) for row in bowl.select(".submissionstatustable tr")
+                     if row.select_one("td") and "due date" in row.get_text().lower()), None)
+    return {"reference_material_link": reference_material.get_text(strip=True) if reference_material else None,
+            "submission_link": submission_link.get("href") if submission_link else None,
+            "deadline": deadline}
+
+
 @ authenticate
-async def find_assignments(cookies, Client: httpx.AsyncClient) -> Tuple[Assignment]:
-    ASSIGNMENT_SELECTOR = r'li[class="activity assign modtype_assign "]'
-
-    courses = await prep_courses()
-    shared_header = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.7113.93 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/jxl,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Origin": "https://icas.bau.edu.lb:8443",
-        "DNT": "1",
-        "Connection": "keep-alive",
-        "Referer": r"https://moodle.bau.edu.lb/my/",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-User": "?1",
-        "Sec-GPC": "1"
-    }
-    shared_header = add_cookies_to_header(shared_header, cookies)
-
-    async def goto_link(link):
-        r = await Client.get(
-            link, headers=shared_header, cookies=cookies)
-        level = logging.warning if r.status_code != 200 else logging.info
-        my_format(r.status_code, "Status code", level)
-
-    async def create_assignments(course: Course):
-        r = await goto_link(course.link)
-        links = clean_iter(soup_bowl(r.text).select(
-            ASSIGNMENT_SELECTOR), out_iter=tuple)
-        for link in links:
-            return Assignment(course.name, link)
-
-    async def find_from_link(link, assignment: Assignment):
-        """
-        selectors for each attribute:
-
-        reference_material : div > h2
-        deadline : div[class='submissionstatustable'] tr[class='']
-        submission_link : div[id='intro'] > div > p >a  (If any)
-        """
-
-        r = await Client.get(link, headers=shared_header, cookies=cookies)
-        bowl = soup_bowl(r.text)
-        refrence_material, submission_link = tuple(map(
-            bowl.select_one, ("div div > h2", "div[id='intro'] > div > p >a")))
-        submission_table = bowl.select(
-            "[class='submissionstatustable'] tr[class=']")
-
-        async def find_deadline(table_list):
-            async def _search_children(tag, query):
-                for child in set(tag.children):
-                    if query.lower() in child.text.lower():
-                        return tag
-            if table_list:
-                deadline = (_search_children(i, "time remaining")
-                            for i in table_list)
-                deadline = collect_tasks(collection=deadline)
-                deadline = next(filter(None, deadline), None).select_one("td")
-                return deadline.text.strip()
-        deadline = await find_deadline(submission_table)
-        refrence_material, submission_link, deadline = tuple(
-            coerce_to_none(refrence_material, submission_link, deadline))
-        for i, j in zip(("submission_link", "refrence_material", "deadline"), (refrence_material, submission_link, deadline)):
-            setattr(assignment, i, j)
-
-    assignments = await collect_tasks(create_assignments, courses)
-    await collect_tasks(find_from_link, assignments)
-    return assignments
-
-
-def all_notifications(res): return asyncio.run(get_data(res))
+async def find_assignments(session: MoodleSession) -> tuple[Assignment, ...]:
+    """
+    Crawls every course page for assignments and then every assignment page for its details,
+    pages that did not change since the last crawl are answered with a 304 and not parsed again.
+    """
+    courses = list(await prep_courses())
+    fetcher = ConditionalFetcher(session.Client, session.headers(PAGE_HEADERS))
+
+    links_per_course = await collect_tasks(lambda course: fetcher.fetch(course.link, parse_course_page), courses)
+    assignments = [Assignment(course.name, link) for course, links in zip(
+        courses, links_per_course) for link in (links or ())]
+    details = await collect_tasks(lambda assignment: fetcher.fetch(assignment.assignment_link, parse_assignment_page), assignments)
+    for assignment, detail in zip(assignments, details):
+        for attribute, value in (detail or {}).items():
+            setattr(assignment, attribute, value)
+    fetcher.save()
+    return tuple(assignments)
@@ -0,0 +1,54 @@
+"""
+Command state per chat (the corrected command waiting for a yes or no), so one bot can serve many groups.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+import time
+from typing import Callable, Hashable, Optional
+
+# a chat that stays quiet this long (seconds) is forgotten, along with its unanswered question
+SESSION_TTL = 600
+
+
+@dataclass
+class ChatState:
+    last_command: Optional[Callable[[str], None]] = None
+    last_argument: str = ""
+    interactive: bool = False
+    last_seen: float = 0.0
+
+
+class ChatSessions:
+    """
+    Chats ordered by their last message, so evicting the expired ones only looks at the oldest.
+    Only used from the bot's loop, there is no lock.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl, self.clock = ttl, clock
+        self.sessions: OrderedDict[Hashable, ChatState] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, chat_id: Hashable) -> ChatState:
+        """
+        The state of chat_id (a new one if it expired or never existed), marked as used now.
+        """
+        now = self.clock()
+        self.evict(now)
+        state = self.sessions.setdefault(chat_id, ChatState())
+        state.last_seen = now
+        self.sessions.move_to_end(chat_id)
+        return state
+
+    def evict(self, now: float) -> int:
+        evicted = 0
+        while self.sessions:
+            chat_id, state = next(iter(self.sessions.items()))
+            if now - state.last_seen <= self.ttl:
+                break
+            del self.sessions[chat_id]
+            evicted += 1
+        return evicted
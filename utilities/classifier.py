@@ -0,0 +1,69 @@
+"""
+Classifies an announcement with one scan of its title and one scan of its message,
+instead of a separate regex per question (importance, type, postponed, meeting links).
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+import re
+from typing import Optional
+
+NON_EXAM_TYPES, EXAM_TYPES = ("lab", "project", "session"), (
+    "quiz", "test", "exam", "grades", "midterm")
+TYPE_DICT = dict.fromkeys(EXAM_TYPES, "exam") | {
+    name: name for name in NON_EXAM_TYPES}
+# only count as whole words, "exams" is not important on its own but it still is an exam
+IMPORTANT_WORDS = frozenset(("lab", "test", "quiz", "final", "grades", "grade", "makeup",
+                            "incomplete exam", "project", "exam", "midterm"))
+POSTPONED_WORDS = frozenset(("postponed", "new date", "delayed"))
+# longest first so that grades wins over grade and incomplete exam over exam
+KEYWORD_REGEX = re.compile("|".join(map(re.escape, sorted(
+    IMPORTANT_WORDS | POSTPONED_WORDS | TYPE_DICT.keys(), key=len, reverse=True))))
+
+# a single character class matching the same characters as the old alternation
+# (a-z|0-9|$-_@.&+|!*(),|%XX), which made the regex engine backtrack over every character
+LINK_REGEX = re.compile(r"http[s]?://[a-zA-Z0-9$-_@.&+!*(),]+")
+MEETING_REGEX = re.compile("teams|zoom|meeting", re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class Classification:
+    important: bool
+    types: frozenset[str]
+    postponed: bool
+    # zoom/teams meeting links in the message
+    links: Optional[tuple[str, ...]]
+
+
+def _is_word_char(text: str, index: int) -> bool:
+    return 0 <= index < len(text) and (text[index].isalnum() or text[index] == "_")
+
+
+def classify_title(title: str) -> tuple[bool, frozenset[str], bool]:
+    """
+    Importance and postponement look at the whole title, types only look past the subject code (after the colon).
+    """
+    title = title.lower()
+    types_start = title.find(":") + 1 if ":" in title else len(title)
+    important, postponed, types = False, False, set()
+    for match in KEYWORD_REGEX.finditer(title):
+        word, start, end = match.group(), match.start(), match.end()
+        if word in POSTPONED_WORDS:
+            postponed = True
+        if word in IMPORTANT_WORDS and not (_is_word_char(title, start - 1) or _is_word_char(title, end)):
+            important = True
+        if start >= types_start:
+            word = "exam" if word == "incomplete exam" else word
+            if word in TYPE_DICT:
+                types.add(TYPE_DICT[word])
+    return important, frozenset(types), postponed
+
+
+def meeting_links(message: str) -> Optional[tuple[str, ...]]:
+    if "http" not in message:
+        return None
+    return tuple(filter(MEETING_REGEX.search, LINK_REGEX.findall(message))) or None
+
+
+def classify(title: str, message: str) -> Classification:
+    important, types, postponed = classify_title(title)
+    return Classification(important, types, postponed, meeting_links(message))
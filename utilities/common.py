@@ -2,33 +2,43 @@ from __future__ import annotations
 import asyncio
 from datetime import datetime
 import difflib
-from functools import reduce
-import html
+from functools import cache, reduce
 import itertools as it
 from dataclasses import dataclass, field
 import json
 import logging
+import os
 import pathlib
 import re
-from types import FunctionType
+from types import FunctionType, MappingProxyType
 from bs4 import BeautifulSoup
-from typing import Any, Coroutine, Iterable, Iterator, List, Generator, Optional, Sequence, TypeVar
+from utilities.classifier import classify
+from typing import Any, Coroutine, Iterable, Iterator, Generator, Mapping, Optional, Sequence, TypeVar
 
 DATA_DIR_PATH = "bot_data_stuff"
 DATA_DIR = pathlib.Path(f"./{DATA_DIR_PATH}").resolve()
 
 T = TypeVar("T")
 
+MOODLE_SERVICE_URL = r"https://moodle.bau.edu.lb/lib/ajax/service.php"
+MOODLE_COOKIES = ("MoodleSession", "BNES_MoodleSession")
+
 now = datetime.now()
 FORMAT = "%(levelname)s %(asctime)s - %(message)s"
-logging.basicConfig(
-    filename=fr"{DATA_DIR}/logs.log",
-    level=logging.DEBUG,
-    format=FORMAT,
-    filemode="w")
 logger = logging.getLogger()
 
 
+def setup_logging(filemode="w"):
+    """
+    Only entry points (the bot, endpoint.py) should call this, importing a module must not truncate the logs.
+    """
+    logging.basicConfig(
+        filename=fr"{DATA_DIR}/logs.log",
+        level=logging.DEBUG,
+        format=FORMAT,
+        filemode=filemode)
+
+
 def to_natural_str(dt: datetime): return dt.strftime("%A %B %d %Y")
 
 
@@ -52,6 +62,8 @@ def file_handler(relative_path: pathlib.Path | None = None):
             def _write_to_file():
                 with open(file, mode) as f:
                     f.write(text)
+                # mtimes can be too coarse to notice two writes in a row
+                FILE_CACHE.pop(file, None)
             mode_dict = {"r": _read_file, "rb": _read_file,
                          "w": _write_to_file, "x": _write_to_file, "wb": _write_to_file}
             return mode_dict[mode]()
@@ -63,6 +75,44 @@ def file_handler(relative_path: pathlib.Path | None = None):
 
 IO_DATA_DIR = file_handler(DATA_DIR)
 
+# resolved path -> ((mtime, size), parsed contents)
+FILE_CACHE: dict[str, tuple[tuple[int, int], Any]] = {}
+
+
+def freeze(obj: Any) -> Any:
+    """
+    Makes parsed json read-only (dicts become mapping proxies and lists become tuples) so a cached copy can be shared.
+    Pass default=dict to json.dumps to write it back.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(i) for i in obj)
+    return obj
+
+
+def cached_json_handler(relative_path: pathlib.Path):
+    """
+    Parses a json file once and hands back the same frozen object until the file's mtime or size changes
+    (or the file is rewritten through file_handler).
+    """
+    read = file_handler(relative_path)
+
+    def load(file: str):
+        path = str(relative_path.joinpath(file).resolve())
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = FILE_CACHE.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        data = freeze(json.loads(read(file)))
+        FILE_CACHE[path] = (key, data)
+        return data
+    return load
+
+
+JSON_DATA_DIR = cached_json_handler(DATA_DIR)
+
 
 def string_builder(strings: Iterable, prefixes: Iterable,
                    separator: str = "\n") -> str:
@@ -76,63 +126,51 @@ def string_builder(strings: Iterable, prefixes: Iterable,
     return separator.join(filter(None, built_strings()))
 
 
-@dataclass
+MESSAGE_SEPARATOR = "---------------------------------------------------------------------"
+
+
+@dataclass(slots=True)
 class Announcement:
+    """
+    Everything derived from the title and the message is computed once here, so filtering
+    and rendering announcements never re-runs regexes or reads mappings.json.
+    """
     title: str
     message: str
     time_created: int
+    subject: Optional[str] = None
+    # moodle's notification id, None when the announcement did not come from moodle
+    id: Optional[int] = None
     deadline: Optional[str] = field(init=False)
     time_delta: Optional[int] = field(init=False)
+    date_created: datetime = field(init=False)
+    subject_code: str = field(init=False)
+    subject_type: frozenset[str] = field(init=False)
+    # zoom/teams meeting links in the message
+    links: Optional[tuple[str, ...]] = field(init=False)
+    important: bool = field(init=False)
+    postponed: bool = field(init=False)
+    # parse_cache_key of the content the deadline was parsed from, set by get_data and saved by the store's annotate
+    parse_key: Optional[str] = field(init=False, default=None, repr=False, compare=False)
+    # (calendar day, deadline, subject) -> text, the last output of notification_message_builder
+    rendered: Optional[tuple[tuple, str]] = field(init=False, default=None, repr=False, compare=False)
 
     def __post_init__(self):
-        self.message = self.message.split(
-            "---------------------------------------------------------------------")[1]
-
-    # This ensures that object attribute setting is done in a maintainable way
-    @property
-    def date_created(self):
-        return datetime.fromtimestamp(self.time_created)
-
-    @property
-    def links(self) -> Optional[tuple[str]]:
-        """
-        An internal function to return zoom meeting links in each announcement object
-        """
-        link_regex = r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
-
-        def meetings_filter(link): return re.findall(
-            "teams|zoom|meeting", link, flags=re.IGNORECASE) is not None
-        links = filter(meetings_filter, re.findall(
-            link_regex, self.message, re.MULTILINE))
-        return bool_return(tuple(links))
-
-    @property
-    def subject_code(self):
-        return self.title.split(":")[0]
-
-    @property
-    def subject_type(self):
-        non_exam_types, exam_types = (
-            "lab", "project", "session"), ("quiz", "test", "exam", "grades", "midterm")
-        type_dict = dict.fromkeys(exam_types, "exam") | {
-            name: name for name in non_exam_types}
-        title = self.title.split(":")[1].lower()
-        types: list[str] = re.findall(
-            "|".join(flattening_iterator(non_exam_types, exam_types)), title)
-        return set(map(lambda x: type_dict.get(x, None), types))
-
-    @property
-    def subject(self):
-        return mappings_wrapper()[self.subject_code]
+        self.message = self.message.split(MESSAGE_SEPARATOR)[1]
+        self.date_created = datetime.fromtimestamp(self.time_created)
+        self.subject_code = self.title.split(":")[0]
+        classification = classify(self.title, self.message)
+        self.subject_type, self.links = classification.types, classification.links
+        self.important, self.postponed = classification.important, classification.postponed
 
 
 @dataclass
 class Assignment:
     subject: str
     assignment_link: str
-    reference_material_link = None
-    deadline = None
-    submission_link = None
+    reference_material_link: Optional[str] = None
+    deadline: Optional[str] = None
+    submission_link: Optional[str] = None
 
 
 class UnexpectedBehaviourError(Exception):
@@ -153,10 +191,36 @@ class UnexpectedBehaviourError(Exception):
         return self.message
 
 
+@dataclass(frozen=True)
 class WebsiteMeta:
-    file = IO_DATA_DIR("creds.txt")
-    file = file.split("\n")
-    username, password, api_key, public_context, testing_chat_context = file
+    username: str
+    password: str
+    api_key: str
+    public_context: str
+    testing_chat_context: str
+
+
+@cache
+def website_meta() -> WebsiteMeta:
+    return WebsiteMeta(*IO_DATA_DIR("creds.txt").split("\n"))
+
+
+@cache
+def bot_settings() -> dict[str, str]:
+    """
+    The key=value lines of settings.cfg.
+    """
+    settings = {}
+    for line in IO_DATA_DIR("settings.cfg").splitlines():
+        key, found, value = line.partition("=")
+        if found:
+            settings[key.strip()] = value.strip()
+    return settings
+
+
+def setting_enabled(name: str) -> bool:
+    # the words true, True, T, yes, y or Yes turn a setting on, anything else (or no setting) leaves it off
+    return bot_settings().get(name, "") in ("true", "True", "T", "yes", "y", "Yes")
 
 
 class NullValueError(Exception):
@@ -439,10 +503,12 @@ def add_cookies_to_header(header: dict, cookies_dict: dict) -> dict:
     moodle_session, bnes_moodle_session = tuple(cookies_dict.get(
         i, None) for i in ('MoodleSession', 'BNES_MoodleSession'))
     if moodle_session and bnes_moodle_session:
+        # drop the cookies of an older session so that logging in again in the same process works
+        header = {k: v for k, v in header.items() if k != "Cookie"}
         return insert_into_dict(header, 10, ("Cookie",
                                              fr"MoodleSession={moodle_session}; BNES_MoodleSession={bnes_moodle_session}"))
     else:
-        raise NullValueError(("moodle_session", moodle_session),
+        raise NullValueError(None, ("moodle_session", moodle_session),
                              ("bnes_moodle_session", bnes_moodle_session))
 
 
@@ -452,29 +518,69 @@ def run(x: Coroutine): return asyncio.run(x)
 def soup_bowl(html): return BeautifulSoup(html, "lxml")
 
 
-def links_and_meetings_wrapper() -> dict[str, list[str]]:
-    return json.loads(IO_DATA_DIR("links_and_meetings.json"))
+def links_and_meetings_wrapper() -> Mapping[str, Sequence[str]]:
+    from utilities.store import get_store
+    return get_store().links()
 
 
-def notifications_wrapper() -> List[dict]:
-    data = IO_DATA_DIR("results.json")
-    return json.loads(data)[0]["data"]["notifications"]
+def is_unseen(notification: dict, high_water_mark: dict[str, int]) -> bool:
+    return (notification["id"], notification["timecreated"]) > (high_water_mark["id"], high_water_mark["timecreated"])
 
 
-def courses_wrapper() -> List[dict]:
-    return json.loads(IO_DATA_DIR("courses.json"))[0]["data"]["courses"]
+def high_water_mark(notifications: Iterable[dict]) -> dict[str, int]:
+    latest = max(notifications, key=lambda x: (
+        x["id"], x["timecreated"]), default=None)
+    if latest is None:
+        return {"id": 0, "timecreated": 0}
+    return {"id": latest["id"], "timecreated": latest["timecreated"]}
 
 
-def mappings_wrapper() -> dict[str, str]:
-    return json.loads(IO_DATA_DIR("mappings.json"))
+def session_wrapper() -> Optional[dict]:
+    """
+    The moodle cookies and sesskey saved by the last login, None if there are none.
+    """
+    try:
+        session = json.loads(IO_DATA_DIR("session.json"))
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+    if all(session.get("cookies", {}).get(i) for i in MOODLE_COOKIES) and session.get("sesskey"):
+        return session
+    return None
+
+
+def save_session(cookies: dict, sesskey: str):
+    session = {"cookies": {i: cookies.get(i)
+                           for i in MOODLE_COOKIES}, "sesskey": sesskey}
+    IO_DATA_DIR("session.json", "w", json.dumps(session))
+
+
+async def probe_session(Client, sesskey: str, headers: Optional[dict] = None) -> bool:
+    """
+    Cheaply checks if a saved moodle session is still alive instead of walking the whole CAS flow again.
+    """
+    params = {"sesskey": sesskey, "info": "core_session_time_remaining"}
+    payload = [{"index": 0, "methodname": "core_session_time_remaining", "args": {}}]
+    r = await Client.post(MOODLE_SERVICE_URL, json=payload, params=params, headers=headers)
+    try:
+        response = r.json()
+        # moodle answers with a dict when the sesskey is wrong and with an error entry when the session expired
+        return not response[0]["error"] and response[0]["data"]["timeremaining"] > 0
+    except (ValueError, KeyError, IndexError, TypeError):
+        return False
+
+
+def courses_wrapper() -> Sequence[Mapping]:
+    from utilities.store import get_store
+    return get_store().courses()
+
+
+def mappings_wrapper() -> Mapping[str, str]:
+    """
+    Subject code -> course name, kept up to date with the courses table.
+    """
+    from utilities.store import get_store
+    return get_store().mappings()
 
-def mapping_init():
-    IO_DATA_DIR("mappings.json", "w", "")
-    data = courses_wrapper()
-    data = (i for i in data)
-    mappings = {item["shortname"]: html.unescape(
-        item["fullname"]).split("-")[0] for item in data}
-    IO_DATA_DIR("mappings.json", "w", json.dumps(mappings, indent=4))
 
 def insert_into_dict(dictionary, index, pair) -> dict:
     keys, values = list(dictionary.keys()), list(dictionary.values())
@@ -482,10 +588,3 @@ def insert_into_dict(dictionary, index, pair) -> dict:
     values.insert(index, pair[1])
     dictionary = dict(zip(keys, values))
     return dictionary
-
-
-def autocorrect(container: Iterable, msg: str, ratio=0.7):
-    msg = msg.lower()
-    corrected = next(
-        filter(lambda x: is_similar(msg, x, ratio), container), None)
-    return corrected
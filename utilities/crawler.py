@@ -0,0 +1,72 @@
+from __future__ import annotations
+import asyncio
+from collections import Counter, defaultdict
+import json
+import logging
+from typing import Any, Callable, Optional
+import httpx
+from utilities.common import IO_DATA_DIR, JSON_DATA_DIR, my_format
+
+# moodle struggles when a lot of pages are requested at once
+MAX_REQUESTS_PER_HOST = 4
+
+
+def http_cache_wrapper() -> dict[str, Any]:
+    """
+    url -> ETag, Last-Modified and the parsed result of the last 200 response.
+    """
+    try:
+        return dict(JSON_DATA_DIR("http_cache.json"))
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+class ConditionalFetcher:
+    """
+    GETs pages with at most per_host requests in flight per host and sends the validators of the last response,
+    so unchanged pages come back as 304 and their parsed result is reused instead of downloading and parsing them again.
+    """
+
+    def __init__(self, Client: httpx.AsyncClient, headers: dict[str, str], per_host: int = MAX_REQUESTS_PER_HOST) -> None:
+        self.Client = Client
+        self.headers = headers
+        self.semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(per_host))
+        self.cache = http_cache_wrapper()
+        self.stats: Counter[str] = Counter()
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        entry = self.cache.get(url, {})
+        headers = dict(self.headers)
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def fetch(self, url: str, parse: Callable[[str], Any]) -> Optional[Any]:
+        """
+        parse turns the page into something json serializable, it is only called when the page changed.
+        A page that cannot be fetched (connection error, timeout) falls back to the result of the last crawl.
+        """
+        try:
+            async with self.semaphores[httpx.URL(url).host]:
+                r = await self.Client.get(url, headers=self.conditional_headers(url))
+        except httpx.HTTPError as e:
+            self.stats["error"] += 1
+            my_format(f"{url} -> {e!r}", "Request failed", logging.warning)
+            return self.cache.get(url, {}).get("result")
+        self.stats[str(r.status_code)] += 1
+        if r.status_code == 304 and url in self.cache:
+            return self.cache[url]["result"]
+        if r.status_code != 200:
+            my_format(f"{url} -> {r.status_code}", "Status code", logging.warning)
+            return None
+        result = parse(r.text)
+        self.cache[url] = {"etag": r.headers.get("ETag"),
+                           "last_modified": r.headers.get("Last-Modified"), "result": result}
+        return result
+
+    def save(self):
+        my_format(dict(self.stats), "Crawler status codes")
+        IO_DATA_DIR("http_cache.json", "w", json.dumps(self.cache, default=dict))
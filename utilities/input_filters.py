@@ -1,53 +1,76 @@
-from collections import Counter
-from typing import List
-from utilities.async_functions import all_notifications, re
-from utilities.common import Announcement, IO_DATA_DIR , gen_exec, is_similar, clean_iter, json, notifications_wrapper
+from collections import Counter, defaultdict
+from typing import List, Optional, Sequence
+from utilities.async_functions import get_data
+from utilities.common import Announcement, gen_exec, is_similar, clean_iter
+from utilities.store import Store, announcement_from_row
 
 
-ALL_NOTIFICATIONS = all_notifications(notifications_wrapper())
+SIMILARITY = 0.7
+
+
+def title_sketch(title: str) -> Counter:
+    return Counter(title)
+
+
+def sketch_ratio(first: Counter, second: Counter, length: int) -> float:
+    """
+    Same value as difflib.SequenceMatcher.quick_ratio, but from character counts that are computed once per title.
+    """
+    if not length:
+        return 1.0
+    matches = sum(min(count, second[char])
+                  for char, count in first.items() if char in second)
+    return 2.0 * matches / length
 
 
 class PostponedHandler:
+    """
+    Clears the type of announcements that a postponed notice supersedes.
+    Candidates only come from the postponed notice's own subject code bucket and titles whose lengths are too far
+    apart to reach the threshold are skipped before the character counts are compared.
+    """
 
     def __init__(self, notifications) -> None:
-        postponed = ("postponed", "new date", "delayed")
         self.notifications = notifications
-        self.postponed_type_notifications = tuple(filter(lambda x: re.findall(
-            "|".join(postponed), x.title.lower()), self.notifications))
+        self.postponed_type_notifications = tuple(
+            filter(lambda x: x.postponed, self.notifications))
+        needed_codes = {i.subject_code for i in self.postponed_type_notifications}
+        # subject code -> (announcement, lowercase title, title sketch), in the original order
+        self.buckets: defaultdict[str, list[tuple[Announcement, str, Counter]]] = defaultdict(list)
+        for i in self.notifications:
+            if i.subject_code in needed_codes:
+                title = i.title.lower()
+                self.buckets[i.subject_code].append(
+                    (i, title, title_sketch(title)))
 
     def __call__(self):
         return self.find_matching()
 
     @staticmethod
     def sentence_difference(s1, s2):
-        return is_similar(s1, s2, 0.7)
-
-    def get_needed_types(self):
-        counts = Counter((i.subject_code for i in self.notifications))
-        unneeded = counts.items()
-        for i in unneeded:
-            if i[1] != 1:
-                yield i[0]
-
-    def generate_from_codes(self, t):
-        for i in self.notifications:
-            if i.subject_code == t.subject_code:
-                yield i
+        return is_similar(s1, s2, SIMILARITY)
 
     def compare_to_notification(self, postponed_type_notification):
-        def possible_duplicate(announcement):
-            if announcement.title.lower() == postponed_type_notification.title.lower():
+        title = postponed_type_notification.title.lower()
+        sketch = title_sketch(title)
+
+        def possible_duplicate(entry: tuple[Announcement, str, Counter]):
+            _, other_title, other_sketch = entry
+            if other_title == title:
+                return False
+            length = len(title) + len(other_title)
+            # quick_ratio is at most 2 * shortest / total, no need to count characters if that is already too low
+            if 2 * min(len(title), len(other_title)) < SIMILARITY * length:
                 return False
-            return is_similar(announcement.title.lower(),
-                              postponed_type_notification.title.lower(), 0.7)
+            return sketch_ratio(sketch, other_sketch, length) >= SIMILARITY
 
-        req = list(filter(possible_duplicate, self.generate_from_codes(
-            postponed_type_notification)))
+        req = [i[0] for i in self.buckets[postponed_type_notification.subject_code]
+               if possible_duplicate(i)]
 
         if req:
             if len(req) > 1:
                 req = req[1:]
-            gen_exec(setattr(i, "subject_type", None) for i in req)
+            gen_exec(setattr(i, "subject_type", frozenset()) for i in req)
 
     def find_matching(self):
         for i in self.postponed_type_notifications:
@@ -55,17 +78,7 @@ class PostponedHandler:
         return self.notifications
 
 
-def update_links(Announcements: List[Announcement]):
-    links_dict = {
-        announcement.subject: announcement.links
-        for announcement in Announcements}
-    IO_DATA_DIR("links_and_meetings.json", "w", json.dumps(
-        links_dict, indent=4)) if links_dict else None
-
-
-
-
-def notification_cleanup(res: List[Announcement]) -> List[Announcement]:
+def notification_cleanup(res: Sequence[Announcement]) -> List[Announcement]:
     important_notifications = hilight(res)
     important_notifications = PostponedHandler(
         important_notifications).find_matching()
@@ -74,12 +87,23 @@ def notification_cleanup(res: List[Announcement]) -> List[Announcement]:
     return important_notifications
 
 
-def hilight(res: List[Announcement]) -> List[Announcement]:
-    def _important_notification(Notification: Announcement):
-        if re.findall(
-            r"\blab\b|\btest\b|\bquiz\b|\bfinal\b|\bgrades\b|\bgrade\b|\bmakeup\b|\bincomplete exam\b|\bproject\b|\bexam\b|\bmidterm\b",
-            Notification.title.lower(),
-                flags=re.MULTILINE):
-            return True
-    important_objects = list(filter(_important_notification, res))
+def hilight(res: Sequence[Announcement]) -> List[Announcement]:
+    # importance is decided once by the classifier when the announcement is built
+    important_objects = [i for i in res if i.important]
     return important_objects
+
+
+async def annotate_changes(store: Store, processes: Optional[int] = 0) -> int:
+    """
+    Parses the deadlines of the announcements that are new or were edited since the last call and runs the cleanup
+    again over the courses they belong to (a postponed notice clears the type of older announcements of its course),
+    the store then holds what the commands query. See parse_deadlines for processes. Returns how many were parsed.
+    """
+    parsed = await get_data(store.unparsed(), processes=processes)
+    store.annotate(parsed)
+    codes = {i.subject_code for i in parsed}
+    if codes:
+        courses = [announcement_from_row(i) for i in store.by_subject_codes(codes)]
+        notification_cleanup(courses)
+        store.annotate(courses)
+    return len(parsed)
@@ -0,0 +1,165 @@
+"""
+One long-lived sender for every outgoing message: rate limited per chat and globally, ordered per chat.
+"""
+from __future__ import annotations
+from collections import OrderedDict, deque
+import logging
+import threading
+import time
+from typing import IO, Callable, Optional, Union
+from utilities.common import my_format
+
+# telegram's limit for the text of one message
+MAX_MESSAGE_LENGTH = 4096
+# telegram allows about one message a second in a chat (20 a minute in groups) and 30 a second overall,
+# going over it anyway (a group) is handled with the retry_after of the 429 reply
+CHAT_RATE, CHAT_BURST = 1.0, 3
+GLOBAL_RATE, GLOBAL_BURST = 30.0, 30
+# text, or a file (named, like io.BytesIO with a name) that is sent as a document and never joined with anything
+Message = Union[str, IO[bytes]]
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Seconds to wait before sending again if error is a 429 reply (telebot's ApiTelegramException), None otherwise.
+    """
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return float(result.get("parameters", {}).get("retry_after", 1))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.updated = capacity, now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class MessageQueue:
+    """
+    Messages wait in a queue per chat and leave it in order, small consecutive texts are joined up to the size limit.
+    A single thread sends them (so at most one message per chat is in flight), serving ready chats round robin.
+    A 429 puts the message back at the head of its chat's queue and pauses the chat for retry_after,
+    any other error is logged and the message dropped.
+    """
+
+    def __init__(self, send: Callable[[int | str, Message], None], chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST, limit: int = MAX_MESSAGE_LENGTH,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.send = send
+        self.chat_rate, self.chat_burst, self.limit, self.clock = chat_rate, chat_burst, limit, clock
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock())
+        # chat -> (pending messages, bucket, paused until), in round robin order
+        self.chats: OrderedDict[int | str, tuple[deque[Message], TokenBucket, list[float]]] = OrderedDict()
+        self.pending = 0
+        # counts put calls, so the sending thread notices messages put while it was busy
+        self.puts = 0
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def put(self, chat_id: int | str, message: Message):
+        with self.condition:
+            if chat_id not in self.chats:
+                self.chats[chat_id] = (deque(), TokenBucket(
+                    self.chat_rate, self.chat_burst, self.clock()), [0.0])
+            self.chats[chat_id][0].append(message)
+            self.pending += 1
+            self.puts += 1
+            self.condition.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every message was sent (or dropped), False on timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    def _next(self, now: float) -> tuple[Optional[tuple[int | str, Message, int]], Optional[float]]:
+        """
+        (chat, message, number of messages joined into it) to send now, or None and the seconds until
+        something can be sent (None when nothing is pending).
+        """
+        if not self.pending:
+            return None, None
+        wait = self.global_bucket.wait(now)
+        if wait:
+            return None, wait
+        for chat_id, (messages, bucket, paused_until) in self.chats.items():
+            if not messages:
+                continue
+            chat_wait = max(bucket.wait(now), paused_until[0] - now)
+            if chat_wait > 0:
+                wait = min(wait or chat_wait, chat_wait)
+                continue
+            bucket.take(now)
+            self.global_bucket.take(now)
+            message, count = messages.popleft(), 1
+            while isinstance(message, str) and messages and isinstance(messages[0], str) \
+                    and len(message) + 1 + len(messages[0]) <= self.limit:
+                message, count = f"{message}\n{messages.popleft()}", count + 1
+            self.chats.move_to_end(chat_id)
+            return (chat_id, message, count), None
+        return None, wait
+
+    def flush(self) -> Optional[float]:
+        """
+        Sends everything the limits allow right now, returns the seconds until the next message can go out
+        (None when nothing is pending).
+        """
+        while True:
+            with self.condition:
+                message, wait = self._next(self.clock())
+            if message is None:
+                return wait
+            chat_id, text, count = message
+            try:
+                self.send(chat_id, text)
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is not None:
+                    with self.condition:
+                        self.chats[chat_id][0].appendleft(text)
+                        self.chats[chat_id][2][0] = self.clock() + delay
+                        self.pending -= count - 1
+                    my_format(delay, f"Rate limited in {chat_id}, retrying after", logging.warning)
+                    continue
+                my_format(e, f"Failed to send a message to {chat_id}", logging.error)
+            with self.condition:
+                self.pending -= count
+                self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                puts = self.puts
+            wait = self.flush()
+            with self.condition:
+                if self.stopped:
+                    return
+                if puts == self.puts:
+                    self.condition.wait(wait)
@@ -0,0 +1,164 @@
+"""
+The one place that talks CAS/moodle login: a single pooled keep-alive client, the login state and the header templates.
+Every fetcher (notifications, courses, assignments) borrows a MoodleSession instead of building its own client and logging in again.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Any, Optional, Union
+import httpx
+from utilities.common import MOODLE_SERVICE_URL, UnexpectedBehaviourError, add_cookies_to_header, css_selector, my_format, probe_session, save_session, session_wrapper, soup_bowl, url_encode, website_meta
+
+LOGIN_URL = r"https://icas.bau.edu.lb:8443/cas/login?service=https%3A%2F%2Fmoodle.bau.edu.lb%2Flogin%2Findex.php"
+SECURE_URL = r"https://moodle.bau.edu.lb/my/"
+LOGIN_QUERYSTRING = {"service": "https://moodle.bau.edu.lb/login/index.php"}
+
+CLIENT_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+CLIENT_TIMEOUT = httpx.Timeout(20.0, connect=10.0)
+
+BASE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.7113.93 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/jxl,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "DNT": "1",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-User": "?1",
+    "Sec-GPC": "1"
+}
+LOGIN_HEADERS = BASE_HEADERS | {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Origin": "https://icas.bau.edu.lb:8443",
+    "Referer": LOGIN_URL}
+# used for the ajax service and for /my/
+SERVICE_HEADERS = BASE_HEADERS | {
+    "Referer": "https://moodle.bau.edu.lb/message/output/popup/notifications.php"}
+API_HEADERS = BASE_HEADERS | {
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Content-Type": "application/json",
+    "X-Requested-With": "XMLHttpRequest",
+    "Origin": "https://moodle.bau.edu.lb",
+    "Referer": SECURE_URL,
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors"}
+# course and assignment pages
+PAGE_HEADERS = BASE_HEADERS | {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Origin": "https://icas.bau.edu.lb:8443",
+    "Referer": SECURE_URL}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class MoodleSession:
+    """
+    Owns one httpx.AsyncClient (http2 only if the h2 package is installed) and the moodle cookies/sesskey.
+    Use it as an async context manager or call login() and close() yourself when it lives longer (the bot keeps one).
+    transport replaces the network layer, the benchmarks use it to point the session at a local stand-in server.
+    """
+
+    def __init__(self, http2: bool = False, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        self.Client = httpx.AsyncClient(follow_redirects=True, timeout=CLIENT_TIMEOUT, limits=CLIENT_LIMITS,
+                                        http2=http2 and http2_available(), transport=transport)
+        self.cookies: dict[str, str] = {}
+        self.sesskey: Optional[str] = None
+        self._login_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> MoodleSession:
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def headers(self, template: dict[str, str] = SERVICE_HEADERS) -> dict[str, str]:
+        return add_cookies_to_header(template, self.cookies)
+
+    def _set_cookies(self, cookies: dict[str, str]):
+        self.cookies = dict(cookies)
+        for name, value in self.cookies.items():
+            self.Client.cookies.set(name, value, domain="moodle.bau.edu.lb")
+
+    async def is_alive(self) -> bool:
+        if self.sesskey is None:
+            return False
+        return await probe_session(self.Client, self.sesskey, self.headers(API_HEADERS))
+
+    async def resume(self) -> bool:
+        """
+        Reuses the cookies and sesskey of the last login (this process or a previous one) if moodle still accepts them.
+        """
+        if await self.is_alive():
+            return True
+        saved = session_wrapper()
+        if not saved:
+            return False
+        self._set_cookies(saved["cookies"])
+        self.sesskey = saved["sesskey"]
+        if await self.is_alive():
+            my_format("Reusing the saved moodle session", "Login")
+            return True
+        my_format("Saved moodle session expired", "Login")
+        self.Client.cookies.clear()
+        self.cookies, self.sesskey = {}, None
+        return False
+
+    async def login(self) -> str:
+        """
+        Walks the CAS flow only when there is no live session, concurrent callers share one login.
+        """
+        async with self._login_lock:
+            if not await self.resume():
+                await self._cas_login()
+            if self.sesskey is None:
+                raise UnexpectedBehaviourError("logged in without a sesskey", self.login)
+            return self.sesskey
+
+    async def _cas_login(self):
+        page = await self.Client.get(url=LOGIN_URL)
+        if page.status_code != 200:
+            raise UnexpectedBehaviourError(
+                f"login page answered {page.status_code}", self._cas_login)
+        execution = css_selector(page.text, "[name=execution]", "value")
+        my_format("execution string: ", execution)
+        await self.Client.post(LOGIN_URL,
+                               data=url_encode(
+                                   {"username": website_meta().username,
+                                    "password": website_meta().password,
+                                    "execution": fr"{execution}", "_eventId": "submit",
+                                    "geolocation": ""}),
+                               headers=LOGIN_HEADERS, params=LOGIN_QUERYSTRING)
+        cookie_jar = dict(self.Client.cookies.items())
+        self.cookies = cookie_jar
+        r = await self.Client.get(SECURE_URL, headers=self.headers())
+        if r.url != SECURE_URL or "notifications" not in r.text:
+            raise UnexpectedBehaviourError(
+                f"login failed, ended up at {r.url}", self._cas_login)
+        sesskey = soup_bowl(r.text).select_one("[name=sesskey]")
+        if sesskey is None or not sesskey.get("value"):
+            raise UnexpectedBehaviourError(
+                "the logged in page has no sesskey", self._cas_login)
+        self.sesskey = sesskey["value"]
+        save_session(cookie_jar, self.sesskey)
+
+    async def service(self, methodname: str, args: dict[str, Any]) -> Union[dict, list]:
+        """
+        Calls a moodle ajax web service function, moodle answers with a dict instead of a list on errors.
+        """
+        payload = [{"index": 0, "methodname": methodname, "args": args}]
+        my_format("Payload json object: ", payload)
+        r = await self.Client.post(url=MOODLE_SERVICE_URL, headers=self.headers(), json=payload,
+                                   params={"sesskey": self.sesskey, "info": methodname})
+        return r.json()
+
+    async def close(self):
+        await self.Client.aclose()
@@ -0,0 +1,92 @@
+"""
+Deadline reminders a week and a day ahead, sent from inside the bot process.
+"""
+from __future__ import annotations
+from datetime import datetime
+import heapq
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+from utilities.common import Announcement, my_format
+from utilities.store import Store, announcement_from_row, get_store
+
+# the clock can jump (suspend, ntp), never sleep longer than this without checking it again
+MAX_SLEEP = 3600
+
+
+class ReminderScheduler:
+    """
+    A heap of (fire time, announcement id, days before) and a thread sleeping until the first one is due.
+    The reminders themselves live in the store, which schedules them whenever a deadline changes,
+    so a restart picks up where the last process stopped and a refresh only pushes what changed.
+    Entries of moved reminders stay in the heap and are dropped when the store refuses to claim them.
+    """
+
+    def __init__(self, send: Callable[[Announcement, int], None], store: Optional[Store] = None) -> None:
+        self.send = send
+        self.store = store
+        self.heap: list[tuple[datetime, int, int]] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = False
+
+    def start(self):
+        if self.store is None:
+            self.store = get_store()
+        self.push(self.store.take_reminders(pending=True))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def update(self):
+        """
+        Queues the reminders scheduled or moved since the last call, call it after the announcements were annotated.
+        Does nothing before start, which loads every pending reminder anyway.
+        """
+        if self.store is None:
+            return
+        self.push(self.store.take_reminders())
+
+    def push(self, reminders: Iterable[tuple[datetime, int, int]]):
+        with self.condition:
+            for i in reminders:
+                heapq.heappush(self.heap, i)
+            self.condition.notify()
+
+    def fire_due(self, now: datetime) -> int:
+        """
+        Sends every reminder due at now, returns how many were sent.
+        Nothing is due before start, which loads the reminders from the store.
+        """
+        if self.store is None:
+            return 0
+        with self.condition:
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+        sent = 0
+        for fire_at, announcement_id, days_before in due:
+            row = self.store.claim_reminder(
+                announcement_id, days_before, fire_at, now)
+            if row is None:
+                continue
+            try:
+                self.send(announcement_from_row(row), days_before)
+                sent += 1
+            except Exception as e:
+                my_format(e, f"Failed to send the reminder of {announcement_id}", logging.error)
+        return sent
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.heap or self.heap[0][0] > datetime.now()):
+                    self.condition.wait(min((self.heap[0][0] - datetime.now()).total_seconds(), MAX_SLEEP)
+                                        if self.heap else None)
+                if self.stopped:
+                    return
+            self.fire_due(datetime.now())
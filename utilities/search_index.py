@@ -0,0 +1,117 @@
+from __future__ import annotations
+from collections import defaultdict
+import difflib
+import re
+from typing import Generic, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+TOKEN_REGEX = re.compile(r"\w+")
+NOT_ALPHANUMERIC_REGEX = re.compile(r"[\W_]+")
+QUERY_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text: str) -> Iterator[str]:
+    return (i.lower() for i in TOKEN_REGEX.findall(text))
+
+
+def parse_query(query: str) -> tuple[list[str], list[list[str]]]:
+    """
+    Splits a query into bare terms and "quoted phrases", every part has to match (AND semantics).
+    """
+    terms, phrases = [], []
+    for phrase, term in QUERY_REGEX.findall(query):
+        if phrase:
+            tokens = list(tokenize(phrase))
+            if len(tokens) > 1:
+                phrases.append(tokens)
+            else:
+                terms.extend(tokens)
+        else:
+            terms.extend(tokenize(term))
+    return terms, phrases
+
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    The query in fts5's syntax for the store's search: bare terms are prefixes (exam -> exams), phrases stay
+    phrases and every part has to match. None if the query has no words.
+    """
+    terms, phrases = parse_query(query)
+    parts = [f'"{i}"*' for i in terms] + [f'"{" ".join(i)}"' for i in phrases]
+    return " ".join(parts) or None
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase letters and digits only, "COMP 210" and "meeting_links" become "comp210" and "meetinglinks".
+    """
+    return NOT_ALPHANUMERIC_REGEX.sub("", text.lower())
+
+
+def trigrams(text: str) -> set[str]:
+    # padded so that short words and the first and last letters count as well
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex(Generic[T]):
+    """
+    Maps normalized keys (command aliases, course codes and names) to values through trigram postings,
+    so a query is only compared with the keys it shares a trigram with instead of every key.
+    Scores are difflib ratios, the best key wins and ties go to the key added first.
+    """
+
+    def __init__(self, entries: Iterable[tuple[str, T]] = ()) -> None:
+        self.keys: list[str] = []
+        self.values: list[T] = []
+        self.postings: defaultdict[str, list[int]] = defaultdict(list)
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key: str, value: T):
+        key_id = len(self.keys)
+        self.keys.append(normalize(key))
+        self.values.append(value)
+        for i in trigrams(self.keys[key_id]):
+            self.postings[i].append(key_id)
+
+    def best(self, query: str, ratio: float = 0.7, substrings: bool = False) -> Optional[tuple[T, float]]:
+        """
+        (value, score) of the key most similar to query, None if no key scores at least ratio.
+        With substrings, keys containing the query match whatever their score and are preferred.
+        """
+        query = normalize(query)
+        if not query:
+            return None
+        candidates = set().union(*(self.postings.get(i, ()) for i in trigrams(query)))
+        if len(query) < 3:
+            # shorter than a trigram, the padded ones only reach keys starting or ending with the query
+            candidates.update(i for i, key in enumerate(self.keys) if query in key)
+        best: Optional[tuple[tuple[bool, float, int], int]] = None
+        matcher = difflib.SequenceMatcher(b=query)
+        for key_id in candidates:
+            key = self.keys[key_id]
+            contained = substrings and query in key
+            # ratio is at most 2 * shortest / total
+            if not contained and 2 * min(len(key), len(query)) < ratio * (len(key) + len(query)):
+                continue
+            matcher.set_seq1(key)
+            rank = (contained, matcher.ratio(), -key_id)
+            if (contained or rank[1] >= ratio) and (best is None or rank > best[0]):
+                best = (rank, key_id)
+        return None if best is None else (self.values[best[1]], best[0][1])
+
+
+def highlight_pattern(query: str) -> Optional[re.Pattern]:
+    terms, phrases = parse_query(query)
+    alternatives = [r"\W+".join(map(re.escape, i)) for i in phrases] + \
+        [fr"{re.escape(i)}\w*" for i in terms]
+    if alternatives:
+        return re.compile(fr"\b(?:{'|'.join(alternatives)})", re.IGNORECASE)
+    return None
+
+
+def highlight(query: str, text: str) -> str:
+    pattern = highlight_pattern(query)
+    return pattern.sub(lambda match: f"[{match.group()}]", text) if pattern else text
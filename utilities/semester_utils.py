@@ -1,13 +1,10 @@
-from copy import deepcopy
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from functools import partial
+from functools import cache
 from io import BufferedReader
 import re
 from typing import Optional
 from utilities.common import DATA_DIR, IO_DATA_DIR, flattening_iterator, null_safe_chaining, to_natural_str
-import requests
-import PyPDF2
 
 from utilities.time_parsing_lib import DAYS, MONTHS
 
@@ -45,7 +42,8 @@ def _find_current_semester(info_obj: SemesterMetaInfo):
     return semester_months[semester_list[semester_list.index(now) - 1]]
 
 
-def find_week_of_datetime(dt: datetime): return dt - timedelta(days=dt.weekday())
+def start_of_week(dt: datetime): return dt - timedelta(days=dt.weekday())
+
 
 def _find_week(info_obj: SemesterMetaInfo, week: int = 0, date: datetime = now):
     # find the current week if week = 0, otherwise find out when a particular week is
@@ -57,7 +55,7 @@ def _find_week(info_obj: SemesterMetaInfo, week: int = 0, date: datetime = now):
     count, curr_dt = 0, FIRST_WEEK_DATE
 
     def in_week(timestamp: datetime, ref: datetime):
-        return find_week_of_datetime(timestamp) == find_week_of_datetime(ref)
+        return start_of_week(timestamp) == start_of_week(ref)
     while not in_week(curr_dt, date):
         count += 1
         curr_dt += timedelta(weeks=1)
@@ -83,6 +81,8 @@ def _get_semester_dicts(text: str):
 
 
 def make_request():
+    # imported here so that importing this module stays cheap
+    import requests
     pdf_req = requests.get(PDF_URL)
     IO_DATA_DIR("smth.pdf", "wb", pdf_req.content)
 
@@ -91,6 +91,7 @@ def read_pdf(): return DATA_DIR.joinpath("smth.pdf").open("rb")
 
 
 def get_pdf_text(fileobj: BufferedReader):
+    import PyPDF2
     text = PyPDF2.PdfFileReader(fileobj)
     page = text.pages[0]
     pdf_txt: str = page.extractText()
@@ -98,24 +99,32 @@ def get_pdf_text(fileobj: BufferedReader):
     return pdf_txt
 
 
-def set_pdf(): return get_pdf_text(read_pdf())
-
-
-pdf_text = set_pdf()
-
+def set_pdf():
+    with read_pdf() as fileobj:
+        return get_pdf_text(fileobj)
 
-meta_inf = SemesterMetaInfo()
-meta_inf.semester_month_dict, meta_inf.inverted_month_dict = _get_semester_dicts(
-    pdf_text)
-meta_inf.semester = _find_current_semester(meta_inf)
 
-
-if max(meta_inf.semester_month_dict).year < now.year:
-    make_request()
-    pdf_text = set_pdf()
+def _make_meta_info(pdf_text: str) -> SemesterMetaInfo:
     meta_inf = SemesterMetaInfo()
-
-
-# Constant to be used by external modules
-FINAL_INFO_OBJ = deepcopy(meta_inf)
-find_week_of_datetime = partial(_find_week, info_obj=FINAL_INFO_OBJ)
+    meta_inf.semester_month_dict, meta_inf.inverted_month_dict = _get_semester_dicts(
+        pdf_text)
+    meta_inf.semester = _find_current_semester(meta_inf)
+    return meta_inf
+
+
+@cache
+def semester_info() -> SemesterMetaInfo:
+    """
+    Parses the university calendar on first use, it is downloaded again if it is missing or outdated.
+    """
+    if not DATA_DIR.joinpath("smth.pdf").exists():
+        make_request()
+    meta_inf = _make_meta_info(set_pdf())
+    if max(meta_inf.semester_month_dict).year < now.year:
+        make_request()
+        meta_inf = _make_meta_info(set_pdf())
+    return meta_inf
+
+
+def find_week_of_datetime(week: int = 0, date: datetime = now):
+    return _find_week(semester_info(), week, date)
@@ -0,0 +1,404 @@
+"""
+SQLite store for announcements, courses and meeting links, written with upserts and read through indexes
+instead of rewriting and re-parsing whole json files.
+"""
+from __future__ import annotations
+from datetime import datetime
+from functools import cache
+import html
+import json
+import pathlib
+import sqlite3
+import threading
+from typing import Iterable, Mapping, Optional, Sequence
+from utilities.classifier import classify_title
+from utilities.async_functions import set_deadline
+from utilities.common import DATA_DIR, MESSAGE_SEPARATOR, Announcement, my_format
+
+STORE_PATH = DATA_DIR.joinpath("bot.sqlite3")
+# the format of to_natural_str, which Announcement.deadline is written in
+DEADLINE_FORMAT = "%A %B %d %Y"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS announcements (
+    id INTEGER PRIMARY KEY,
+    timecreated INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    fullmessage TEXT NOT NULL,
+    subject_code TEXT NOT NULL,
+    important INTEGER NOT NULL,
+    postponed INTEGER NOT NULL,
+    -- iso date, filled in by annotate once the deadline was parsed
+    deadline TEXT
+);
+CREATE INDEX IF NOT EXISTS announcements_subject_code ON announcements (subject_code, timecreated);
+CREATE INDEX IF NOT EXISTS announcements_timecreated ON announcements (timecreated);
+CREATE INDEX IF NOT EXISTS announcements_deadline ON announcements (deadline) WHERE deadline IS NOT NULL;
+-- types after notification_cleanup (superseded announcements have none), filled in by annotate
+CREATE TABLE IF NOT EXISTS announcement_types (
+    type TEXT NOT NULL,
+    announcement_id INTEGER NOT NULL REFERENCES announcements (id) ON DELETE CASCADE,
+    PRIMARY KEY (type, announcement_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS courses (
+    shortname TEXT PRIMARY KEY,
+    fullname TEXT NOT NULL,
+    -- what mappings.json used to hold: the course name without the section
+    name TEXT NOT NULL,
+    viewurl TEXT NOT NULL
+);
+-- append-only, a link is inserted once per subject and only removed by compact_links
+CREATE TABLE IF NOT EXISTS links (
+    subject TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (subject, url)
+) WITHOUT ROWID;
+"""
+# applied in order on top of SCHEMA, PRAGMA user_version counts the ones a database already has
+MIGRATIONS = (
+    # announcements whose links were not collected yet, an edit makes an announcement unscanned again
+    """
+    ALTER TABLE announcements ADD COLUMN links_scanned INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX announcements_links_unscanned ON announcements (id) WHERE NOT links_scanned;
+    """,
+    # deadline reminders a week and a day ahead at 8 in the morning, kept in step with the deadlines by the trigger.
+    # queued is cleared whenever a reminder is (re)scheduled so the scheduler only picks up what changed
+    """
+    CREATE TABLE reminders (
+        announcement_id INTEGER NOT NULL REFERENCES announcements (id) ON DELETE CASCADE,
+        days_before INTEGER NOT NULL,
+        fire_at TEXT NOT NULL,
+        sent INTEGER NOT NULL DEFAULT 0,
+        queued INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (announcement_id, days_before)
+    ) WITHOUT ROWID;
+    CREATE INDEX reminders_unsent ON reminders (fire_at) WHERE NOT sent;
+    CREATE INDEX reminders_unqueued ON reminders (announcement_id) WHERE NOT queued;
+    CREATE TRIGGER announcements_reminders AFTER UPDATE OF deadline, important ON announcements
+    BEGIN
+        DELETE FROM reminders WHERE announcement_id = new.id AND NOT sent;
+        -- a postponed deadline is reminded about again
+        INSERT INTO reminders (announcement_id, days_before, fire_at)
+        SELECT new.id, days.value, datetime(new.deadline, '-' || days.value || ' days', '+8 hours')
+        FROM (SELECT 7 AS value UNION ALL SELECT 1) AS days WHERE new.deadline IS NOT NULL AND new.important
+        ON CONFLICT (announcement_id, days_before) DO UPDATE SET fire_at = excluded.fire_at, sent = 0, queued = 0
+        WHERE reminders.fire_at IS NOT excluded.fire_at;
+    END;
+    INSERT INTO reminders (announcement_id, days_before, fire_at)
+    SELECT id, days.value, datetime(deadline, '-' || days.value || ' days', '+8 hours')
+    FROM announcements, (SELECT 7 AS value UNION ALL SELECT 1) AS days
+    WHERE deadline >= date('now', 'localtime') AND important;
+    """,
+    # parse_cache_key of the content the deadline was parsed from, get_data parses an announcement again once
+    # its content stops matching (it was edited)
+    """
+    ALTER TABLE announcements ADD COLUMN parse_key TEXT;
+    CREATE INDEX announcements_unparsed ON announcements (id) WHERE parse_key IS NULL;
+    CREATE INDEX announcements_important ON announcements (timecreated) WHERE important;
+    """,
+    # full text search over the messages (what Announcement.message keeps), kept in step by the triggers.
+    # contentless, the text is only stored once, deleting an entry takes the text it was indexed with
+    """
+    CREATE VIRTUAL TABLE announcements_search USING fts5(
+        message, content = '', tokenize = "unicode61 remove_diacritics 0 tokenchars '_'");
+    CREATE TRIGGER announcements_search_insert AFTER INSERT ON announcements
+    BEGIN
+        INSERT INTO announcements_search (rowid, message) VALUES (new.id, message_body(new.fullmessage));
+    END;
+    CREATE TRIGGER announcements_search_update AFTER UPDATE OF fullmessage ON announcements
+    BEGIN
+        INSERT INTO announcements_search (announcements_search, rowid, message)
+        VALUES ('delete', old.id, message_body(old.fullmessage));
+        INSERT INTO announcements_search (rowid, message) VALUES (new.id, message_body(new.fullmessage));
+    END;
+    CREATE TRIGGER announcements_search_delete AFTER DELETE ON announcements
+    BEGIN
+        INSERT INTO announcements_search (announcements_search, rowid, message)
+        VALUES ('delete', old.id, message_body(old.fullmessage));
+    END;
+    INSERT INTO announcements_search (rowid, message) SELECT id, message_body(fullmessage) FROM announcements;
+    """,
+)
+
+ANNOUNCEMENT_COLUMNS = "announcements.id, announcements.timecreated, announcements.subject, announcements.fullmessage, " \
+    "announcements.deadline, announcements.parse_key, courses.name AS course_name"
+ANNOUNCEMENT_QUERY = f"SELECT {ANNOUNCEMENT_COLUMNS} FROM announcements LEFT JOIN courses ON courses.shortname = announcements.subject_code"
+NEWEST_FIRST = "ORDER BY announcements.timecreated DESC, announcements.id DESC"
+
+
+def course_name(fullname: str) -> str:
+    return html.unescape(fullname).split("-")[0]
+
+
+def message_body(fullmessage: str) -> str:
+    # the part Announcement.message keeps, without the title and moodle's footer
+    parts = fullmessage.split(MESSAGE_SEPARATOR)
+    return parts[1] if len(parts) > 1 else fullmessage
+
+
+def deadline_to_iso(deadline: Optional[str]) -> Optional[str]:
+    return datetime.strptime(deadline, DEADLINE_FORMAT).date().isoformat() if deadline else None
+
+
+class Store:
+    """
+    One connection shared by the polling thread and the refresh loop, every call holds the lock.
+    """
+
+    def __init__(self, path: pathlib.Path | str = STORE_PATH) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        # the search triggers call it, registered before anything is written
+        self.connection.create_function("message_body", 1, message_body, deterministic=True)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA foreign_keys = ON")
+            self.connection.executescript(SCHEMA)
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                self.connection.executescript(
+                    f"BEGIN; {migration} PRAGMA user_version = {number}; COMMIT;")
+
+    def execute(self, query: str, parameters: Sequence = ()) -> list[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def write(self, query: str, rows: Iterable[Sequence]) -> int:
+        with self.lock, self.connection:
+            return self.connection.executemany(query, rows).rowcount
+
+    def upsert_notifications(self, notifications: Iterable[Mapping]) -> int:
+        """
+        Moodle notification payloads, an edited notification replaces the stored copy.
+        """
+        def _rows():
+            for i in notifications:
+                important, _, postponed = classify_title(i["subject"])
+                yield (i["id"], i["timecreated"], i["subject"], i["fullmessage"], i["subject"].split(":")[0],
+                       important, postponed)
+        return self.write("""
+            INSERT INTO announcements (id, timecreated, subject, fullmessage, subject_code, important, postponed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET timecreated = excluded.timecreated, subject = excluded.subject,
+                fullmessage = excluded.fullmessage, subject_code = excluded.subject_code,
+                important = excluded.important, postponed = excluded.postponed, links_scanned = 0, parse_key = NULL
+            WHERE (announcements.subject, announcements.fullmessage, announcements.timecreated)
+                IS NOT (excluded.subject, excluded.fullmessage, excluded.timecreated)""", _rows())
+
+    def notifications(self) -> list[dict]:
+        """
+        Newest first, in the shape moodle sends them plus the parsed deadline and its parse_key.
+        """
+        return [dict(i) for i in self.execute(
+            "SELECT id, timecreated, subject, fullmessage, deadline, parse_key FROM announcements "
+            "ORDER BY timecreated DESC, id DESC")]
+
+    def unparsed(self) -> list[dict]:
+        """
+        Announcements whose deadline was not parsed yet (new or edited ones), in the shape get_data takes.
+        """
+        return [dict(i) for i in self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.parse_key IS NULL {NEWEST_FIRST}")]
+
+    def high_water_mark(self) -> dict[str, int]:
+        row = self.execute(
+            "SELECT id, timecreated FROM announcements ORDER BY id DESC, timecreated DESC LIMIT 1")
+        return dict(row[0]) if row else {"id": 0, "timecreated": 0}
+
+    def annotate(self, announcements: Iterable[Announcement]):
+        """
+        Saves what get_data and notification_cleanup worked out (deadlines with their parse keys and types) so they can be queried.
+        """
+        announcements = [i for i in announcements if i.id is not None]
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE announcements SET deadline = ? WHERE id = ? AND deadline IS NOT ?",
+                                        ((deadline_to_iso(i.deadline), i.id, deadline_to_iso(i.deadline)) for i in announcements))
+            # separately, the reminders trigger fires on any update of deadline
+            self.connection.executemany("UPDATE announcements SET parse_key = ? WHERE id = ? AND parse_key IS NOT ?",
+                                        ((i.parse_key, i.id, i.parse_key) for i in announcements if i.parse_key))
+            self.connection.executemany("DELETE FROM announcement_types WHERE announcement_id = ?",
+                                        ((i.id,) for i in announcements))
+            self.connection.executemany("INSERT OR IGNORE INTO announcement_types (type, announcement_id) "
+                                        "SELECT ?, id FROM announcements WHERE id = ?",
+                                        ((kind, i.id) for i in announcements for kind in i.subject_type))
+
+    def by_subject_codes(self, codes: Iterable[str]) -> list[sqlite3.Row]:
+        codes = tuple(codes)
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.subject_code IN ({', '.join('?' * len(codes))}) "
+                            f"{NEWEST_FIRST}", codes)
+
+    def by_type(self, kind: str) -> list[sqlite3.Row]:
+        return self.execute(f"{ANNOUNCEMENT_QUERY} JOIN announcement_types ON announcement_types.announcement_id = announcements.id "
+                            f"WHERE announcement_types.type = ? {NEWEST_FIRST}", (kind,))
+
+    def by_ids(self, ids: Iterable[int]) -> list[sqlite3.Row]:
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.id IN (SELECT value FROM json_each(?)) {NEWEST_FIRST}",
+                            (json.dumps(list(ids)),))
+
+    def important(self) -> list[sqlite3.Row]:
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.important {NEWEST_FIRST}")
+
+    def created_since(self, timestamp: int) -> list[sqlite3.Row]:
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.timecreated > ? {NEWEST_FIRST}", (timestamp,))
+
+    def deadlines_between(self, start: datetime, end: datetime, important_only: bool = True) -> list[sqlite3.Row]:
+        """
+        Soonest first, announcements with the same deadline newest first.
+        """
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.deadline BETWEEN ? AND ? "
+                            f"{'AND announcements.important' if important_only else ''} ORDER BY announcements.deadline, "
+                            "announcements.timecreated DESC, announcements.id DESC",
+                            (start.date().isoformat(), end.date().isoformat()))
+
+    def search(self, match: str) -> list[sqlite3.Row]:
+        """
+        Announcements whose message matches an fts5 query (see search_index.fts_query), newest first.
+        """
+        return self.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.id IN "
+                            f"(SELECT rowid FROM announcements_search WHERE announcements_search MATCH ?) {NEWEST_FIRST}", (match,))
+
+    def columns(self) -> list[sqlite3.Row]:
+        """
+        What AnnouncementTable filters on: id, timecreated, deadline, subject code and the types (comma separated), newest first.
+        """
+        return self.execute("SELECT announcements.id, announcements.timecreated, announcements.deadline, announcements.subject_code, "
+                            "group_concat(announcement_types.type) AS types FROM announcements "
+                            "LEFT JOIN announcement_types ON announcement_types.announcement_id = announcements.id "
+                            f"GROUP BY announcements.id {NEWEST_FIRST}")
+
+    def upsert_courses(self, courses: Iterable[Mapping]):
+        """
+        courses is the whole enrolment, courses from previous semesters are dropped.
+        An empty enrolment is ignored rather than taken as "drop every course" (and with them every link).
+        """
+        courses = list(courses)
+        if not courses:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("""
+                INSERT INTO courses (shortname, fullname, name, viewurl) VALUES (?, ?, ?, ?)
+                ON CONFLICT (shortname) DO UPDATE SET fullname = excluded.fullname, name = excluded.name,
+                    viewurl = excluded.viewurl""",
+                                        ((i["shortname"], i["fullname"], course_name(i["fullname"]), i["viewurl"]) for i in courses))
+            self.connection.execute(f"DELETE FROM courses WHERE shortname NOT IN ({', '.join('?' * len(courses))})",
+                                    [i["shortname"] for i in courses])
+        self.compact_links()
+
+    def courses(self) -> list[dict]:
+        return [dict(i) for i in self.execute("SELECT shortname, fullname, viewurl FROM courses ORDER BY fullname")]
+
+    def mappings(self) -> dict[str, str]:
+        return {i["shortname"]: i["name"] for i in self.execute("SELECT shortname, name FROM courses ORDER BY fullname")}
+
+    def add_links(self, links: Iterable[tuple[str, str]]) -> int:
+        """
+        (subject, url) pairs, a link is only ever stored once per subject.
+        """
+        return self.write("INSERT OR IGNORE INTO links (subject, url) VALUES (?, ?)", links)
+
+    def scan_links(self) -> int:
+        """
+        Collects the meeting links of the announcements that were not scanned yet (new or edited ones),
+        returns how many were scanned.
+        """
+        with self.lock, self.connection:
+            announcements = [announcement_from_row(i) for i in self.connection.execute(
+                f"{ANNOUNCEMENT_QUERY} WHERE NOT announcements.links_scanned")]
+            self.connection.executemany("INSERT OR IGNORE INTO links (subject, url) VALUES (?, ?)",
+                                        ((i.subject or i.subject_code, link) for i in announcements
+                                         if i.links and i.subject_type for link in i.links))
+            self.connection.executemany("UPDATE announcements SET links_scanned = 1 WHERE id = ?",
+                                        ((i.id,) for i in announcements))
+        return len(announcements)
+
+    def compact_links(self) -> int:
+        """
+        Drops the links of courses that are not in the enrolment anymore, links reset every semester.
+        """
+        if self.is_empty("courses"):
+            return 0
+        return self.write("DELETE FROM links WHERE subject NOT IN (SELECT name FROM courses) "
+                          "AND subject NOT IN (SELECT shortname FROM courses)", [()])
+
+    def take_reminders(self, pending: bool = False) -> list[tuple[datetime, int, int]]:
+        """
+        (fire time, announcement id, days before) of the reminders scheduled or moved since the last call,
+        or of every unsent one when pending. Reminders of deadlines that passed are left out.
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT reminders.fire_at, reminders.announcement_id, reminders.days_before FROM reminders "
+                "JOIN announcements ON announcements.id = reminders.announcement_id "
+                f"WHERE NOT reminders.sent {'' if pending else 'AND NOT reminders.queued'} "
+                "AND announcements.deadline >= date('now', 'localtime')").fetchall()
+            self.connection.execute("UPDATE reminders SET queued = 1 WHERE NOT queued")
+        return [(datetime.fromisoformat(fire_at), announcement_id, days_before) for fire_at, announcement_id, days_before in rows]
+
+    def claim_reminder(self, announcement_id: int, days_before: int, fire_at: datetime, now: datetime) -> Optional[sqlite3.Row]:
+        """
+        Marks a reminder as sent and returns its announcement, None when the reminder was moved, already sent,
+        is for a deadline that passed or was overtaken by the day-before reminder (the bot was down for a while).
+        """
+        with self.lock, self.connection:
+            if not self.connection.execute("UPDATE reminders SET sent = 1 WHERE announcement_id = ? AND days_before = ? "
+                                           "AND fire_at = ? AND NOT sent",
+                                           (announcement_id, days_before, fire_at.isoformat(" "))).rowcount:
+                return None
+            if self.connection.execute("SELECT 1 FROM reminders WHERE announcement_id = ? AND days_before < ? AND fire_at <= ?",
+                                       (announcement_id, days_before, now.isoformat(" "))).fetchone():
+                return None
+            return self.connection.execute(f"{ANNOUNCEMENT_QUERY} WHERE announcements.id = ? AND announcements.deadline >= ?",
+                                           (announcement_id, now.date().isoformat())).fetchone()
+
+    def links(self) -> dict[str, list[str]]:
+        links: dict[str, list[str]] = {}
+        for i in self.execute("SELECT subject, url FROM links ORDER BY subject, url"):
+            links.setdefault(i["subject"], []).append(i["url"])
+        return links
+
+    def is_empty(self, table: str) -> bool:
+        return not self.execute(f"SELECT 1 FROM {table} LIMIT 1")
+
+    def import_json_files(self, data_dir: pathlib.Path = DATA_DIR):
+        """
+        Moves the data of the json files the bot used to keep into empty tables, once.
+        """
+        def _load(file: str):
+            try:
+                return json.loads(data_dir.joinpath(file).read_text())
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                return None
+        imports = (("announcements", "results.json", lambda x: self.upsert_notifications(x[0]["data"]["notifications"])),
+                   ("courses", "courses.json",
+                    lambda x: self.upsert_courses(x[0]["data"]["courses"])),
+                   ("links", "links_and_meetings.json", lambda x: self.add_links((subject, url) for subject, urls in x.items() for url in urls or ())))
+        for table, file, load in imports:
+            if self.is_empty(table) and (data := _load(file)):
+                try:
+                    load(data)
+                    my_format(file, f"Imported into the {table} table")
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    my_format(file, "Skipped malformed file")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+@cache
+def get_store() -> Store:
+    """
+    The store in the data directory, created (and filled from the old json files) on first use.
+    """
+    store = Store()
+    store.import_json_files()
+    return store
+
+
+def announcement_from_row(row: sqlite3.Row) -> Announcement:
+    announcement = Announcement(row["subject"], row["fullmessage"], row["timecreated"],
+                                subject=row["course_name"], id=row["id"])
+    set_deadline(announcement, datetime.fromisoformat(
+        row["deadline"]) if row["deadline"] else None)
+    announcement.parse_key = row["parse_key"]
+    return announcement
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from calendar import monthrange
 from datetime import datetime, timedelta
 import re
 from typing import Callable, Generator, Optional, Sequence
@@ -58,13 +59,43 @@ def _change_dt(anchor: datetime, operation: str = '-') -> Callable[[datetime_dic
             timedelta(days=simplified_dict["days"]) if operation == "-" else anchor + timedelta(
                 days=simplified_dict["days"])
         # the month might change if a few days are added, so the anchor's month cannot be taken.
-        return transformed_date.replace(month=transformed_date.month - simplified_dict["months"], year=transformed_date.year - simplified_dict["years"]) if operation == "-" else transformed_date.replace(month=transformed_date.month + simplified_dict["months"], year=transformed_date.year + simplified_dict["years"])
+        # months carry into years and the day is clamped, january 31st + 1 month is the end of february
+        sign = -1 if operation == "-" else 1
+        year, month = divmod(transformed_date.year * 12 + transformed_date.month - 1 + sign * (
+            simplified_dict["months"] + 12 * simplified_dict["years"]), 12)
+        return transformed_date.replace(year=year, month=month + 1, day=min(transformed_date.day, monthrange(year, month + 1)[1]))
     return convert_unit
 
 
 subtract_from_now = _change_dt(now)
 
 
+def relative_range(query: str, anchor: datetime) -> Optional[tuple[bool, datetime]]:
+    """
+    Parses ranges like "3 days", "next week", "month", "tomorrow" (forwards from the anchor) or
+    "past 2 weeks", "3 days ago" (backwards), returns (backwards, the other end) or None if the query is not a range
+    or the other end is not a representable date ("9999 years"). An empty query is a week ahead.
+    """
+    words = query.lower().split()
+    backwards = words[:1] in (["past"], ["last"]) or words[-1:] == ["ago"]
+    words = [i for i in words if i not in ("past", "last", "next", "ago", "the")]
+    amount = int(words.pop(0)) if words and words[0].isdecimal() else None
+    if words == ["today"] and amount is None and not backwards:
+        amount, unit = 0, "day"
+    elif words == ["tomorrow"] and amount is None and not backwards:
+        amount, unit = 1, "day"
+    elif not words:
+        unit = "day" if amount is not None else "week"
+    elif len(words) == 1 and words[0] in DATE_WORDS:
+        unit = DATE_WORDS[words[0]]
+    else:
+        return None
+    try:
+        return backwards, _change_dt(anchor, "-" if backwards else "+")({unit: 1 if amount is None else amount})
+    except (ValueError, OverflowError):
+        return None
+
+
 class RelativeDate:
     positive_offsets, negative_offsets = (
         ("next ", "after", "following"),